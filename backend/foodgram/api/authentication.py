@@ -0,0 +1,144 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+from .utils import TTLCache, bump_version, get_version
+
+AUTH_TOKEN_KEY = 'auth_token:{}'
+AUTH_TOKEN_VERSION_KEY = 'auth_token_version:{}'
+# Сколько токенов хранится в памяти процесса и сколько секунд
+# хранятся записи в памяти процесса и в общем кэше
+AUTH_CACHE_SIZE = 1000
+AUTH_CACHE_TTL = 60
+# Сколько секунд запись в памяти процесса используется без обращений
+# к общему кэшу: токен, удалённый в другом процессе, действует здесь
+# не дольше этого срока
+AUTH_LOCAL_TTL = 5
+# Поля пользователя в кэше. Хэш пароля в кэш не попадает, а счётчики
+# рецептов и подписчиков из кэша устарели бы: остальные поля отложены,
+# и save() без update_fields записывает только загруженные поля.
+# Порядок полей модели: в нём значения ожидает Model.from_db
+USER_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {'id', 'email', 'username', 'first_name',
+                         'last_name', 'is_active', 'is_staff',
+                         'is_superuser', 'last_login', 'date_joined'}
+)
+TOKEN_FIELDS = ('key', 'user_id', 'created')
+
+
+def token_digest(key):
+    # Сами токены в ключах кэша не хранятся
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def token_entry(token):
+    """
+    Данные токена и пользователя для кэша: значения полей
+    TOKEN_FIELDS и USER_FIELDS
+    """
+    return (tuple(getattr(token, field) for field in TOKEN_FIELDS),
+            tuple(getattr(token.user, field) for field in USER_FIELDS))
+
+
+def token_from_entry(entry):
+    """
+    Токен с пользователем из данных кэша, как после загрузки из БД;
+    поля не из USER_FIELDS отложены и загружаются только при обращении
+    """
+    token_values, user_values = entry
+    token = Token.from_db(DEFAULT_DB_ALIAS, TOKEN_FIELDS, token_values)
+    token.user = User.from_db(DEFAULT_DB_ALIAS, USER_FIELDS, user_values)
+    return token
+
+
+class TokenCache(TTLCache):
+    """
+    Данные токенов с пользователями: в памяти процесса (LRU) и в общем
+    кэше. Запись в общем кэше хранится с версией токена и действительна,
+    пока версия не изменилась (см. invalidate_tokens), но не дольше
+    AUTH_CACHE_TTL секунд после загрузки из БД. Запись в памяти процесса
+    используется без обращений к общему кэшу AUTH_LOCAL_TTL секунд,
+    затем сверяется с ним заново
+    """
+    def __init__(self, maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL,
+                 local_ttl=AUTH_LOCAL_TTL):
+        # Сроки записей сравниваются со сроками из общего кэша
+        super().__init__(maxsize, ttl, timer=time.time)
+        self.local_ttl = local_ttl
+
+    def get(self, digest):
+        """
+        Версия токена и данные из памяти процесса или, за одно обращение,
+        из общего кэша; данные None, если их нужно загрузить из БД
+        """
+        local = self.lookup(digest)
+        if local is not None:
+            return local[0], local[2]
+        version_key = AUTH_TOKEN_VERSION_KEY.format(digest)
+        entry_key = AUTH_TOKEN_KEY.format(digest)
+        values = cache.get_many([version_key, entry_key])
+        version = values.get(version_key)
+        if version is None:
+            return get_version(version_key), None
+        shared = values.get(entry_key)
+        if (shared is None or shared[0] != version
+                or shared[1] <= self.timer()):
+            return version, None
+        self._store_local(digest, *shared)
+        return version, shared[2]
+
+    def _store_local(self, digest, version, expires, entry):
+        self.store(digest, version, entry,
+                   min(expires, self.timer() + self.local_ttl))
+
+    def set(self, digest, version, entry):
+        expires = self.timer() + self.ttl
+        cache.set(AUTH_TOKEN_KEY.format(digest), (version, expires, entry),
+                  self.ttl)
+        self._store_local(digest, version, expires, entry)
+
+
+token_cache = TokenCache()
+
+
+def invalidate_tokens(keys):
+    """
+    Сбросить пользователей токенов keys во всех процессах
+    после фиксации транзакции
+    """
+    digests = [token_digest(key) for key in keys]
+
+    def bump():
+        for digest in digests:
+            # Записи с прежней версией больше не используются
+            bump_version(AUTH_TOKEN_VERSION_KEY.format(digest))
+        token_cache.discard(digests)
+    if digests:
+        transaction.on_commit(bump)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к БД для известных токенов:
+    токен с пользователем строится по данным из token_cache. Версия
+    токена читается до запроса к БД, поэтому удаление токена или
+    изменение пользователя во время запроса не оставит в кэше
+    устаревшую запись
+    """
+    def authenticate_credentials(self, key):
+        digest = token_digest(key)
+        version, entry = token_cache.get(digest)
+        if entry is None:
+            _, token = super().authenticate_credentials(key)
+            if version is not None:
+                token_cache.set(digest, version, token_entry(token))
+            return token.user, token
+        # Каждый запрос получает свои объекты токена и пользователя
+        token = token_from_entry(entry)
+        return token.user, token
@@ -0,0 +1,60 @@
+import gzip
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from .utils import bump_version, get_version
+
+TAGS_VERSION_KEY = 'tags_version'
+CATALOG_TIMEOUT = 60 * 60 * 24
+# Справочники меняются только через админку: браузер использует
+# сохранённую копию CATALOG_MAX_AGE секунд, затем проверяет ETag
+CATALOG_MAX_AGE = 60 * 10
+
+
+def bump_tags_version():
+    bump_version(TAGS_VERSION_KEY)
+
+
+def get_tags_version():
+    return get_version(TAGS_VERSION_KEY)
+
+
+def get_catalog_snapshot(name, version, get_data):
+    """
+    Сжатый JSON справочника и его ETag. Снимок создаётся один раз
+    для каждой версии справочника и хранится в кэше
+    """
+    key = f'catalog:{name}:{version}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        content = JSONRenderer().render(get_data())
+        snapshot = (quote_etag(hashlib.sha256(content).hexdigest()),
+                    gzip.compress(content))
+        cache.set(key, snapshot, CATALOG_TIMEOUT)
+    return snapshot
+
+
+def catalog_response(request, name, version, get_data):
+    """
+    Ответ со снимком справочника: 304, если у клиента та же версия,
+    иначе JSON, сжатый gzip, если клиент его принимает
+    """
+    etag, compressed = get_catalog_snapshot(name, version, get_data)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = HttpResponse(compressed,
+                                    content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(compressed),
+                                    content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={CATALOG_MAX_AGE}'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,37 @@
+from django.core.cache import cache
+
+from .utils import bump_version
+
+# Сколько секунд хранятся записи об изменениях
+CHANGE_TIMEOUT = 60 * 60
+# Если изменений больше, индекс строится заново
+CHANGES_MAX = 1000
+
+
+def record_change(version_key, change_key, ids):
+    """
+    Записать в журнал изменение объектов ids под следующим номером.
+    Номер последнего изменения — версия version_key (см. get_version)
+    """
+    version = bump_version(version_key)
+    if version is None:
+        # Ключ вытеснен из кэша: с новым случайным номером
+        # индексы всех процессов строятся заново
+        return
+    cache.set(change_key.format(version), list(ids), CHANGE_TIMEOUT)
+
+
+def changes_since(change_key, since, version, changes_max=CHANGES_MAX):
+    """
+    Id объектов, изменившихся после изменения since до version
+    включительно; None, если изменений слишком много или часть
+    записей уже вытеснена из кэша
+    """
+    if since is None or not 0 < version - since <= changes_max:
+        return None
+    changes = cache.get_many([
+        change_key.format(number) for number in range(since + 1, version + 1)
+    ])
+    if len(changes) != version - since:
+        return None
+    return {pk for ids in changes.values() for pk in ids}
@@ -0,0 +1,51 @@
+import hashlib
+
+from django.utils.http import quote_etag
+
+from .catalog import get_tags_version
+from .membership import get_membership
+from .search import get_ingredients_version
+
+VALIDATOR_FIELDS = ('id', 'modified', 'author_id')
+VIEWER_FIELDS = ('viewer_favorited', 'viewer_in_shopping_cart',
+                 'viewer_subscribed')
+
+
+def validator_rows(queryset):
+    """
+    Данные рецептов, от которых зависит ответ: id, время изменения, автор
+    """
+    return queryset.prefetch_related(None).values(*VALIDATOR_FIELDS)
+
+
+def viewer_rows(rows, request):
+    """
+    Строки validator_rows с флагами текущего пользователя (избранное,
+    покупки, подписка на автора) из его Membership
+    """
+    if not request.user.is_authenticated:
+        return list(rows)
+    membership = get_membership(request)
+    return [dict(
+        row,
+        viewer_favorited=row['id'] in membership.favorites,
+        viewer_in_shopping_cart=row['id'] in membership.shopping_cart,
+        viewer_subscribed=row['author_id'] in membership.subscriptions,
+    ) for row in rows]
+
+
+def recipes_etag(rows, user, extra=(), weak=False):
+    """
+    ETag ответа с рецептами rows: учитывает версии рецептов, флаги
+    пользователя и версии справочников тегов и ингредиентов
+    """
+    parts = [str(user.pk or 0), str(get_tags_version()),
+             str(get_ingredients_version()), *map(str, extra)]
+    for row in rows:
+        parts.append(':'.join(
+            [str(row['id']), row['modified'].isoformat()]
+            + [str(int(row[field])) for field in VIEWER_FIELDS
+               if field in row]
+        ))
+    etag = quote_etag(hashlib.sha256('|'.join(parts).encode()).hexdigest())
+    return f'W/{etag}' if weak else etag
@@ -1,6 +1,21 @@
 from django_filters import rest_framework as filters
 
-from recipes.models import Recipe, Tag
+from recipes.models import IngredientRecipe, Recipe, Tag
+from users.models import User
+from .matching import recipe_ingredient_index
+from .membership import RECIPE_RELATED_FIELDS, get_membership
+from .search import search_recipes
+from .utils import IN_LIST_MAX
+
+# Связи пользователей с рецептами для фильтров по Membership
+USER_RECIPE_LINKS = {
+    'is_favorited': User.favourites.through,
+    'is_in_shopping_cart': User.shopping_cart.through,
+}
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
 
 
 class RecipeFilterSet(filters.FilterSet):
@@ -11,10 +26,55 @@ class RecipeFilterSet(filters.FilterSet):
     )
     is_favorited = filters.BooleanFilter(method='filter_by_user')
     is_in_shopping_cart = filters.BooleanFilter(method='filter_by_user')
+    search = filters.CharFilter(method='filter_search')
+    include = NumberInFilter(method='filter_include')
+    exclude = NumberInFilter(method='filter_exclude')
 
     def filter_by_user(self, queryset, name, value):
-        return queryset.filter(**{name: self.request.user})
+        """
+        Рецепты из избранного или списка покупок пользователя -
+        по id из его Membership; больше IN_LIST_MAX id - подзапросом
+        """
+        recipe_ids = getattr(get_membership(self.request),
+                             RECIPE_RELATED_FIELDS[name])
+        if len(recipe_ids) <= IN_LIST_MAX:
+            return queryset.filter(pk__in=recipe_ids)
+        return queryset.filter(pk__in=USER_RECIPE_LINKS[name].objects.filter(
+            user_id=self.request.user.id).values('recipe_id'))
+
+    def filter_search(self, queryset, name, value):
+        """
+        Полнотекстовый поиск по названию и тексту рецепта,
+        результаты упорядочены по релевантности
+        """
+        return search_recipes(queryset, value)
+
+    def filter_include(self, queryset, name, value):
+        """
+        Рецепты со всеми указанными ингредиентами
+        """
+        ingredient_ids = {int(pk) for pk in value}
+        recipe_ids = recipe_ingredient_index.containing_all(ingredient_ids)
+        if len(recipe_ids) <= IN_LIST_MAX:
+            return queryset.filter(pk__in=recipe_ids)
+        for ingredient_id in ingredient_ids:
+            queryset = queryset.filter(
+                pk__in=IngredientRecipe.objects.filter(
+                    ingredient_id=ingredient_id).values('recipe_id'))
+        return queryset
+
+    def filter_exclude(self, queryset, name, value):
+        """
+        Рецепты без указанных ингредиентов
+        """
+        ingredient_ids = {int(pk) for pk in value}
+        recipe_ids = recipe_ingredient_index.containing_any(ingredient_ids)
+        if len(recipe_ids) <= IN_LIST_MAX:
+            return queryset.exclude(pk__in=recipe_ids)
+        return queryset.exclude(pk__in=IngredientRecipe.objects.filter(
+            ingredient_id__in=ingredient_ids).values('recipe_id'))
 
     class Meta:
         model = Recipe
-        fields = ['author', 'tags', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'include', 'exclude']
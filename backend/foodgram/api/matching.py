@@ -0,0 +1,123 @@
+import threading
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from recipes.models import IngredientRecipe
+from .changes import changes_since, record_change
+from .utils import get_version
+
+RECIPE_INGREDIENTS_VERSION_KEY = 'recipe_ingredients_version'
+RECIPE_INGREDIENTS_CHANGE_KEY = 'recipe_ingredients_change:{}'
+
+
+def recipe_ingredients_changed(recipe_ids):
+    """
+    Сообщить индексам всех процессов, что изменился состав рецептов
+    recipe_ids. Изменение записывается после фиксации транзакции,
+    чтобы индексы не прочитали старые данные
+    """
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: record_change(
+            RECIPE_INGREDIENTS_VERSION_KEY, RECIPE_INGREDIENTS_CHANGE_KEY,
+            recipe_ids))
+
+
+class RecipeIngredientIndex:
+    """
+    Индекс ингредиентов рецептов в памяти процесса:
+    - recipes - множество ингредиентов каждого рецепта;
+    - postings - множество рецептов с каждым ингредиентом.
+    Изменения рецептов, записанные recipe_ingredients_changed,
+    применяются к индексу по одному рецепту; если изменений слишком
+    много или часть из них уже вытеснена из кэша, индекс строится заново.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._recipes = {}
+        self._postings = defaultdict(set)
+
+    def _load(self, ingredient_recipes):
+        recipes = defaultdict(set)
+        for recipe_id, ingredient_id in ingredient_recipes.values_list(
+                'recipe_id', 'ingredient_id').iterator():
+            recipes[recipe_id].add(ingredient_id)
+        for recipe_id, ingredients in recipes.items():
+            self._recipes[recipe_id] = frozenset(ingredients)
+            for ingredient_id in ingredients:
+                self._postings[ingredient_id].add(recipe_id)
+
+    def _rebuild(self):
+        self._recipes = {}
+        self._postings = defaultdict(set)
+        self._load(IngredientRecipe.objects.all())
+
+    def _update(self, recipe_ids):
+        for recipe_id in recipe_ids:
+            for ingredient_id in self._recipes.pop(recipe_id, ()):
+                self._postings[ingredient_id].discard(recipe_id)
+        self._load(IngredientRecipe.objects.filter(recipe_id__in=recipe_ids))
+
+    def sync(self):
+        version = get_version(RECIPE_INGREDIENTS_VERSION_KEY)
+        with self._lock:
+            if version == self._version:
+                return
+            changed = changes_since(RECIPE_INGREDIENTS_CHANGE_KEY,
+                                    self._version, version)
+            if changed is None:
+                self._rebuild()
+            else:
+                self._update(changed)
+            self._version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def coverage(self, ingredient_ids, max_missing=None):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов
+        ingredient_ids: список (id, matched, missing) - сколько
+        ингредиентов рецепта есть и сколько не хватает, от рецептов
+        с наименьшим числом недостающих
+        """
+        with self._lock:
+            self.sync()
+            matched = Counter()
+            for ingredient_id in set(ingredient_ids):
+                matched.update(self._postings.get(ingredient_id, ()))
+            results = [
+                (recipe_id, count, len(self._recipes[recipe_id]) - count)
+                for recipe_id, count in matched.items()
+            ]
+        if max_missing is not None:
+            results = [result for result in results
+                       if result[2] <= max_missing]
+        results.sort(key=lambda result: (result[2], -result[1], -result[0]))
+        return results
+
+    def containing_all(self, ingredient_ids):
+        with self._lock:
+            self.sync()
+            postings = sorted(
+                (self._postings.get(ingredient_id, set())
+                 for ingredient_id in set(ingredient_ids)),
+                key=len
+            )
+            if not postings:
+                return set()
+            return postings[0].intersection(*postings[1:])
+
+    def containing_any(self, ingredient_ids):
+        with self._lock:
+            self.sync()
+            return set().union(*(
+                self._postings.get(ingredient_id, ())
+                for ingredient_id in set(ingredient_ids)
+            ))
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
@@ -0,0 +1,114 @@
+from django.db import transaction
+
+from recipes.models import Subscription
+from users.models import User
+from .utils import TTLCache, bump_version, get_version
+
+MEMBERSHIP_VERSION_KEY = 'membership_version:{}'
+# Сколько пользователей хранится в памяти процесса и сколько секунд
+MEMBERSHIP_CACHE_SIZE = 1000
+MEMBERSHIP_TTL = 60 * 5
+# Связи рецепта с пользователями и соответствующие множества Membership
+RECIPE_RELATED_FIELDS = {
+    'is_favorited': 'favorites',
+    'is_in_shopping_cart': 'shopping_cart',
+}
+
+
+class Membership:
+    """
+    Множества id рецептов в избранном и в списке покупок пользователя
+    и id авторов, на которых он подписан
+    """
+    __slots__ = ('favorites', 'shopping_cart', 'subscriptions')
+
+    def __init__(self, favorites=(), shopping_cart=(), subscriptions=()):
+        self.favorites = frozenset(favorites)
+        self.shopping_cart = frozenset(shopping_cart)
+        self.subscriptions = frozenset(subscriptions)
+
+    @classmethod
+    def load(cls, user_id):
+        return cls(
+            User.favourites.through.objects.filter(
+                user_id=user_id).values_list('recipe_id', flat=True),
+            User.shopping_cart.through.objects.filter(
+                user_id=user_id).values_list('recipe_id', flat=True),
+            Subscription.objects.filter(
+                user_id=user_id).values_list('author_id', flat=True),
+        )
+
+
+class MembershipCache(TTLCache):
+    """
+    Membership пользователей в памяти процесса: загружается при первом
+    обращении, вытесняется по LRU и через MEMBERSHIP_TTL секунд.
+    Версия данных пользователя хранится в кэше Django: изменения,
+    сделанные в этом процессе, применяются к множествам на месте,
+    а процессы с другой версией загружают их заново
+    """
+    def __init__(self, maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_TTL):
+        super().__init__(maxsize, ttl)
+
+    def get(self, user_id):
+        version = get_version(MEMBERSHIP_VERSION_KEY.format(user_id))
+        entry = self.lookup(user_id)
+        if entry is not None and version is not None and entry[0] == version:
+            return entry[2]
+        membership = Membership.load(user_id)
+        self.store(user_id, version, membership)
+        return membership
+
+    def _apply(self, user_id, field, ids, added):
+        version = bump_version(MEMBERSHIP_VERSION_KEY.format(user_id))
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            if (entry[0] is None or version is None
+                    or entry[0] + 1 != version):
+                # Данные уже изменены другим процессом
+                del self._entries[user_id]
+                return
+            membership = entry[2]
+            # Множества заменяются, а не изменяются: их могут читать
+            # другие потоки
+            current = getattr(membership, field)
+            setattr(membership, field,
+                    current | ids if added else current - ids)
+            self._entries[user_id] = (version, entry[1], membership)
+
+    def changed(self, user_id, field, ids, added):
+        """
+        Добавить (added) или удалить ids из множества field
+        пользователя после фиксации транзакции
+        """
+        ids = frozenset(ids)
+        transaction.on_commit(
+            lambda: self._apply(user_id, field, ids, added))
+
+    def invalidate(self, user_ids):
+        user_ids = list(user_ids)
+
+        def drop():
+            for user_id in user_ids:
+                bump_version(MEMBERSHIP_VERSION_KEY.format(user_id))
+            self.discard(user_ids)
+        transaction.on_commit(drop)
+
+
+membership_cache = MembershipCache()
+EMPTY_MEMBERSHIP = Membership()
+
+
+def get_membership(request):
+    """
+    Membership текущего пользователя, один раз за запрос
+    """
+    if not request.user.is_authenticated:
+        return EMPTY_MEMBERSHIP
+    membership = getattr(request, '_membership', None)
+    if membership is None:
+        membership = membership_cache.get(request.user.id)
+        request._membership = membership
+    return membership
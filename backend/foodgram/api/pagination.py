@@ -1,5 +1,97 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
 
 
-class CustomPagination(PageNumberPagination):
+class IdCursorPagination(CursorPagination):
+    """
+    Постраничный вывод по курсору: без COUNT(*) и OFFSET,
+    время ответа не зависит от номера страницы
+    """
+    ordering = '-id'
     page_size_query_param = 'limit'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
+
+class FeedCursorPagination(IdCursorPagination):
+    """
+    Постраничный вывод ленты по курсору: позиция курсора - id последнего
+    рецепта страницы, id рецептов страницы возвращает функция
+    get_recipe_ids(before, limit)
+    """
+    def paginate_feed(self, get_recipe_ids, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        cursor = self.decode_cursor(request)
+        before = None
+        if cursor is not None and cursor.position is not None:
+            try:
+                before = int(cursor.position)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+        recipe_ids = get_recipe_ids(before, self.page_size + 1)
+        self.has_next = len(recipe_ids) > self.page_size
+        recipe_ids = recipe_ids[:self.page_size]
+        self.next_position = recipe_ids[-1] if recipe_ids else None
+        return recipe_ids
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False, position=str(self.next_position)))
+
+    def get_previous_link(self):
+        return None
+
+
+class LimitPageNumberPagination(PageNumberPagination):
+    page_size_query_param = 'limit'
+
+
+class CustomPagination(LimitPageNumberPagination):
+    """
+    Постраничный вывод по номеру страницы, а при наличии
+    параметра cursor (пустого для первой страницы) - по курсору
+    """
+    cursor_pagination_class = IdCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        cursor_pagination = self.cursor_pagination_class()
+        if cursor_pagination.cursor_query_param in request.query_params:
+            self.cursor_pagination = cursor_pagination
+            return cursor_pagination.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_page_state(self):
+        """
+        Число объектов и ссылки на соседние страницы -
+        для валидатора ответа со страницей
+        """
+        if self.cursor_pagination is not None:
+            pagination = self.cursor_pagination
+            return (pagination.count, pagination.get_next_link(),
+                    pagination.get_previous_link())
+        return (self.page.paginator.count, self.get_next_link(),
+                self.get_previous_link())
@@ -0,0 +1,413 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, TrigramSimilarity)
+from django.db import connection, transaction
+from django.db.models import (BooleanField, Case, F, IntegerField, Q, Value,
+                              When)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Lower, Replace
+
+from recipes.models import Ingredient, Recipe
+from .changes import changes_since, record_change
+from .utils import IN_LIST_MAX, bump_version, get_version
+
+INGREDIENTS_VERSION_KEY = 'ingredients_index_version'
+INGREDIENTS_SEARCH_LIMIT = 20
+RECIPES_VERSION_KEY = 'recipes_index_version'
+RECIPES_CHANGE_KEY = 'recipes_index_change:{}'
+# Сколько первых результатов поиска рецептов по индексу в памяти
+# упорядочены по релевантности, остальные - от новых к старым
+RECIPES_RANKED_MAX = 1000
+# Временная таблица соединения с id найденных рецептов
+SEARCH_MATCHES_TABLE = 'search_matches'
+# Порог схожести, как pg_trgm.similarity_threshold по умолчанию
+TRIGRAM_THRESHOLD = 0.3
+
+# Ранги результатов нечёткого поиска
+RANK_PREFIX = 0
+RANK_WORD_START = 1
+RANK_TRIGRAM = 2
+
+# Название ингредиента, приведённое в СУБД к виду normalize,
+# см. индекс recipes_ingredient_normalized_name_trgm
+NORMALIZED_NAME = Replace(Lower('name'), Value('ё'), Value('е'))
+
+# Полнотекстовый поиск рецептов на PostgreSQL
+SEARCH_CONFIG = 'russian'
+RECIPE_SEARCH_VECTOR = (
+    SearchVector('name', weight='A', config=SEARCH_CONFIG)
+    + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+)
+# Веса названия и текста рецепта в индексе в памяти,
+# как веса A и B в ts_rank
+NAME_WEIGHT = 1.0
+TEXT_WEIGHT = 0.4
+# Окончания, отбрасываемые при упрощённом стемминге, от длинных к коротким
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую',
+    'юю', 'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+STEM_MIN_LENGTH = 3
+
+
+def normalize(text):
+    """
+    Приведение строки к виду для поиска:
+    без учёта регистра, «ё» считается «е»
+    """
+    return text.casefold().replace('ё', 'е').strip()
+
+
+def trigrams(text):
+    """
+    Триграммы строки, как их считает pg_trgm:
+    каждое слово дополняется двумя пробелами в начале и одним в конце
+    """
+    result = set()
+    for word in text.split():
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def similarity(first, second):
+    if not first or not second:
+        return 0.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+def stem(word):
+    """
+    Упрощённый стемминг: отбрасывается одно окончание,
+    если остаётся не меньше STEM_MIN_LENGTH букв
+    """
+    for ending in RUSSIAN_ENDINGS:
+        if (word.endswith(ending)
+                and len(word) - len(ending) >= STEM_MIN_LENGTH):
+            return word[:-len(ending)]
+    return word
+
+
+def stems(text):
+    return [stem(word) for word in re.findall(r'\w+', normalize(text))]
+
+
+def bump_ingredients_version():
+    bump_version(INGREDIENTS_VERSION_KEY)
+
+
+def get_ingredients_version():
+    return get_version(INGREDIENTS_VERSION_KEY)
+
+
+def recipes_changed(recipe_ids):
+    """
+    Сообщить индексам всех процессов, что изменились названия или
+    тексты рецептов recipe_ids. Изменение записывается после фиксации
+    транзакции, чтобы индексы не прочитали старые данные
+    """
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: record_change(
+            RECIPES_VERSION_KEY, RECIPES_CHANGE_KEY, recipe_ids))
+
+
+def prefix_range(keys, query):
+    """
+    Позиции ключей отсортированного массива, начинающихся с query
+    """
+    position = bisect_left(keys, query)
+    while position < len(keys) and keys[position].startswith(query):
+        yield position
+        position += 1
+
+
+class IngredientSnapshot:
+    """
+    Неизменяемый снимок индекса:
+    - keys/rows - нормализованные названия и строки, по алфавиту;
+    - word_keys/word_positions - окончания названий, начинающиеся
+      со второго и следующих слов, для поиска по началу слова;
+    - postings - позиции названий для каждой триграммы.
+    """
+    def __init__(self, ingredients):
+        entries = sorted(
+            (normalize(name), (pk, name, unit))
+            for pk, name, unit in ingredients
+        )
+        self.keys = [key for key, _ in entries]
+        self.rows = [row for _, row in entries]
+        self.grams = [trigrams(key) for key in self.keys]
+
+        words = []
+        self.postings = defaultdict(list)
+        for position, key in enumerate(self.keys):
+            start = key.find(' ')
+            while start != -1:
+                words.append((key[start + 1:], position))
+                start = key.find(' ', start + 1)
+            for gram in self.grams[position]:
+                self.postings[gram].append(position)
+        words.sort()
+        self.word_keys = [word for word, _ in words]
+        self.word_positions = [position for _, position in words]
+
+    def trigram_candidates(self, grams):
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        for position, count in shared.items():
+            score = count / (len(grams) + len(self.grams[position]) - count)
+            if score >= TRIGRAM_THRESHOLD:
+                yield position
+
+
+class IngredientIndex:
+    """
+    Индекс названий ингредиентов в памяти процесса.
+    Названия хранятся в отсортированном массиве, поиск по префиксу -
+    двоичный поиск. Индекс перестраивается, когда меняется версия
+    в общем кэше.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._snapshot = IngredientSnapshot([])
+
+    def sync(self):
+        version = get_ingredients_version()
+        if version == self._version:
+            return self._snapshot
+        with self._lock:
+            if version != self._version:
+                self._snapshot = IngredientSnapshot(
+                    Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit'))
+                self._version = version
+            return self._snapshot
+
+    def invalidate(self):
+        self._version = None
+
+    @staticmethod
+    def serialize(row, score=None):
+        pk, name, unit = row
+        data = {'id': pk, 'name': name, 'measurement_unit': unit}
+        if score is not None:
+            data['score'] = round(score, 3)
+        return data
+
+    def prefix(self, query, limit=INGREDIENTS_SEARCH_LIMIT):
+        snapshot = self.sync()
+        positions = prefix_range(snapshot.keys, normalize(query))
+        return [
+            self.serialize(snapshot.rows[position])
+            for _, position in zip(range(limit), positions)
+        ]
+
+    def fuzzy(self, query, limit=INGREDIENTS_SEARCH_LIMIT):
+        """
+        Нечёткий поиск: сначала совпадения по началу названия,
+        затем по началу любого слова, затем по схожести триграмм
+        """
+        snapshot = self.sync()
+        query = normalize(query)
+        grams = trigrams(query)
+        ranks = {}
+        for position in prefix_range(snapshot.keys, query):
+            ranks.setdefault(position, RANK_PREFIX)
+        for word_position in prefix_range(snapshot.word_keys, query):
+            ranks.setdefault(
+                snapshot.word_positions[word_position], RANK_WORD_START)
+        for position in snapshot.trigram_candidates(grams):
+            ranks.setdefault(position, RANK_TRIGRAM)
+        results = sorted(
+            (rank, -similarity(grams, snapshot.grams[position]), position)
+            for position, rank in ranks.items()
+        )
+        return [
+            self.serialize(snapshot.rows[position], -score)
+            for _, score, position in results[:limit]
+        ]
+
+
+def fuzzy_search(query, limit=INGREDIENTS_SEARCH_LIMIT):
+    """
+    На PostgreSQL поиск выполняется по GIN-индексу триграмм
+    нормализованного названия, на остальных СУБД - по индексу в памяти.
+    Запрос и названия нормализуются одинаково, поэтому ранги совпадают
+    """
+    if connection.vendor != 'postgresql':
+        return ingredient_index.fuzzy(query, limit)
+    query = normalize(query)
+    ingredients = Ingredient.objects.annotate(
+        normalized_name=NORMALIZED_NAME
+    ).filter(
+        Q(normalized_name__startswith=query)
+        | Q(normalized_name__contains=f' {query}')
+        | Q(normalized_name__trigram_similar=query)
+    ).annotate(
+        rank=Case(
+            When(normalized_name__startswith=query,
+                 then=Value(RANK_PREFIX)),
+            When(normalized_name__contains=f' {query}',
+                 then=Value(RANK_WORD_START)),
+            default=Value(RANK_TRIGRAM),
+            output_field=IntegerField(),
+        ),
+        score=TrigramSimilarity('normalized_name', query),
+    ).order_by('rank', '-score', 'normalized_name').values_list(
+        'id', 'name', 'measurement_unit', 'score')[:limit]
+    return [
+        ingredient_index.serialize((pk, name, unit), score)
+        for pk, name, unit, score in ingredients
+    ]
+
+
+class RecipeIndex:
+    """
+    Обратный индекс названий и текстов рецептов в памяти процесса:
+    - documents - основы слов каждого рецепта;
+    - postings - веса рецептов для каждой основы слова.
+    Используется вместо полнотекстового поиска на СУБД, кроме PostgreSQL.
+    Изменения рецептов, записанные recipes_changed, применяются
+    к индексу по одному рецепту, как в RecipeIngredientIndex.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._documents = {}
+        self._postings = defaultdict(dict)
+
+    def _load(self, recipes):
+        for pk, name, text in recipes.values_list(
+                'id', 'name', 'text').iterator():
+            weights = Counter()
+            for word in stems(name):
+                weights[word] += NAME_WEIGHT
+            for word in stems(text):
+                weights[word] += TEXT_WEIGHT
+            self._documents[pk] = tuple(weights)
+            for word, weight in weights.items():
+                self._postings[word][pk] = weight
+
+    def _rebuild(self):
+        self._documents = {}
+        self._postings = defaultdict(dict)
+        self._load(Recipe.objects.all())
+
+    def _update(self, recipe_ids):
+        for pk in recipe_ids:
+            for word in self._documents.pop(pk, ()):
+                postings = self._postings[word]
+                del postings[pk]
+                if not postings:
+                    del self._postings[word]
+        self._load(Recipe.objects.filter(pk__in=recipe_ids))
+
+    def sync(self):
+        version = get_version(RECIPES_VERSION_KEY)
+        with self._lock:
+            if version == self._version:
+                return
+            changed = changes_since(RECIPES_CHANGE_KEY, self._version,
+                                    version)
+            if changed is None:
+                self._rebuild()
+            else:
+                self._update(changed)
+            self._version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def search(self, query):
+        """
+        Id всех рецептов, содержащих все слова запроса,
+        по убыванию релевантности
+        """
+        words = set(stems(query))
+        if not words:
+            return []
+        with self._lock:
+            self.sync()
+            matches = sorted(
+                (self._postings.get(word, {}) for word in words), key=len)
+            ranks = {
+                pk: sum(match[pk] for match in matches)
+                for pk in matches[0]
+                if all(pk in match for match in matches[1:])
+            }
+        return sorted(ranks, key=lambda pk: (-ranks[pk], -pk))
+
+
+def recipe_id_column():
+    quote_name = connection.ops.quote_name
+    return f'{quote_name(Recipe._meta.db_table)}.{quote_name("id")}'
+
+
+def recipe_ids_condition(ids):
+    """
+    Условие «id рецепта из ids». Id - целые числа из индекса: до
+    IN_LIST_MAX id записываются в текст запроса (число параметров
+    запроса в SQLite ограничено), больше - во временную таблицу
+    соединения. В таблице хранится результат последнего поиска,
+    поэтому условие действительно до следующего поиска в этом
+    соединении, то есть в пределах запроса к API
+    """
+    column = recipe_id_column()
+    if len(ids) <= IN_LIST_MAX:
+        return RawSQL(f'{column} IN ({",".join(map(str, ids))})', (),
+                      output_field=BooleanField())
+    table = connection.ops.quote_name(SEARCH_MATCHES_TABLE)
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {table} '
+                       f'(recipe_id integer PRIMARY KEY)')
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.executemany(f'INSERT INTO {table} (recipe_id) VALUES (%s)',
+                           [(pk,) for pk in ids])
+    return RawSQL(f'{column} IN (SELECT recipe_id FROM {table})', (),
+                  output_field=BooleanField())
+
+
+def search_recipes(queryset, query):
+    """
+    На PostgreSQL поиск выполняется по сохранённому и проиндексированному
+    search_vector, на остальных СУБД - по индексу в памяти
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(query, config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-id')
+    ids = recipe_index.search(query)
+    if not ids:
+        return queryset.none()
+    column = recipe_id_column()
+    ranked = ids[:RECIPES_RANKED_MAX]
+    rank = RawSQL(
+        f'CASE {column} '
+        + ' '.join(f'WHEN {pk} THEN {position}'
+                   for position, pk in enumerate(ranked))
+        + f' ELSE {len(ranked)} END', (),
+        output_field=IntegerField())
+    return queryset.filter(recipe_ids_condition(ids)).order_by(
+        rank.asc(), '-id')
+
+
+def update_search_vector(recipe_ids):
+    if connection.vendor == 'postgresql':
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            search_vector=RECIPE_SEARCH_VECTOR)
+
+
+ingredient_index = IngredientIndex()
+recipe_index = RecipeIndex()
@@ -1,10 +1,24 @@
+from django import forms
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.images import sniff_image_type, variant_names
+from recipes.jobs import enqueue_image_jobs
+from recipes.models import (FeedItem, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingListItem, StoredFile, Tag)
 from users.models import User
+from .matching import recipe_ingredients_changed
+from .membership import get_membership
+from .search import recipes_changed, update_search_vector
+from .shopping_cart import invalidate_recipe_shopping_carts
+from .similar import similar_recipes_changed
+from .utils import RECIPES_LIMIT_MAX, get_recipes_limit
 
 
 class UserRegistrationSerializer(UserCreateSerializer):
@@ -28,9 +42,7 @@ class UserSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if not request.user.is_authenticated:
-            return False
-        return obj.subscribed_users.filter(user=request.user).exists()
+        return obj.id in get_membership(request).subscriptions
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -47,9 +59,101 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('name', 'slug', 'color')
 
 
+def to_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_referenced_objects(recipes_data):
+    """
+    Теги и ингредиенты, на которые ссылаются данные рецептов,
+    загруженные двумя запросами
+    """
+    tag_ids, ingredient_ids = set(), set()
+    for data in recipes_data:
+        if not isinstance(data, dict):
+            continue
+        tags = data.get('tags')
+        if isinstance(tags, list):
+            tag_ids.update(to_pk(pk) for pk in tags)
+        ingredients = data.get('ingredients')
+        if isinstance(ingredients, list):
+            ingredient_ids.update(
+                to_pk(ingredient.get('id')) for ingredient in ingredients
+                if isinstance(ingredient, dict))
+    tag_ids.discard(None)
+    ingredient_ids.discard(None)
+    return {
+        'tags': Tag.objects.in_bulk(tag_ids),
+        'ingredients': Ingredient.objects.in_bulk(ingredient_ids),
+    }
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Объект по первичному ключу берётся из словаря в контексте
+    сериализатора (context_key), если словарь загружен заранее
+    """
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        objects = self.context.get(self.context_key)
+        if objects is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool) or to_pk(data) is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return objects[to_pk(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+class DeferredBase64ImageField(Base64ImageField):
+    """
+    Изображение в base64 только декодируется, тип определяется
+    по заголовку. Проверка Pillow выполняется в фоновой обработке.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('_DjangoImageField', forms.FileField)
+        super().__init__(*args, **kwargs)
+
+    def get_file_extension(self, filename, decoded_file):
+        extension = sniff_image_type(decoded_file)
+        if extension is None:
+            raise DjangoValidationError(self.INVALID_FILE_MESSAGE)
+        return extension
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Адреса уменьшенных вариантов изображения: {variant: url},
+    пока изображение обрабатывается - None
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        value = recipe.image
+        if not value or recipe.image_status != Recipe.IMAGE_READY:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        for variant, name in variant_names(value.name).items():
+            url = default_storage.url(name)
+            urls[variant] = (request.build_absolute_uri(url)
+                             if request is not None else url)
+        return urls
+
+
 class IngredientRecipeSerializer(serializers.ModelSerializer):
 
-    id = serializers.PrimaryKeyRelatedField(
+    id = PreloadedPrimaryKeyRelatedField(
+        context_key='ingredients',
         source='ingredient',
         queryset=Ingredient.objects.all()
     )
@@ -73,7 +177,8 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = PreloadedPrimaryKeyRelatedField(
+        context_key='tags',
         many=True,
         queryset=Tag.objects.all()
     )
@@ -81,7 +186,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         many=True,
         source='ingredients_amount'
     )
-    image = Base64ImageField()
+    image = DeferredBase64ImageField()
 
     class Meta:
         model = Recipe
@@ -89,6 +194,18 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'name', 'text', 'cooking_time', 'image')
         read_only_fields = ('id', 'author')
 
+    def to_internal_value(self, data):
+        # Теги и ингредиенты загружаются одним запросом на модель,
+        # а не отдельным запросом на каждый id
+        if 'ingredients' not in self.context:
+            self.context.update(get_referenced_objects([data]))
+        return super().to_internal_value(data)
+
+    def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], 'tags', 'ingredients_amount__ingredient')
+        return super().to_representation(instance)
+
     def validate_cooking_time(self, value):
         if (value < 1):
             raise serializers.ValidationError(
@@ -98,8 +215,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     def validate(self, data):
 
         request = self.context['request']
-        if (request.method == 'POST' and Recipe.objects.filter(
-                name=data['name'], text=data['text']).exists()):
+        if request.method == 'POST' and self.recipe_exists(data):
             raise ValidationError('Такой рецепт уже существует')
 
         validated_tags = set()
@@ -120,32 +236,157 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
         return data
 
+    def recipe_exists(self, data):
+        # При пакетном создании существующие рецепты загружены заранее
+        existing_recipes = self.context.get('existing_recipes')
+        if existing_recipes is not None:
+            return (data['name'], data['text']) in existing_recipes
+        return Recipe.objects.filter(
+            name=data['name'], text=data['text']).exists()
+
     @staticmethod
     def add_ingredients(recipe, ingredients_data):
-        for ingredient_data in ingredients_data:
-            IngredientRecipe.objects.create(
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(
                 recipe=recipe,
                 amount=ingredient_data.get('amount'),
                 ingredient=ingredient_data.get('ingredient')
             )
+            for ingredient_data in ingredients_data
+        ])
+        recipe_ingredients_changed([recipe.id])
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients_data):
+        """
+        Записать только изменившиеся ингредиенты рецепта
+        """
+        current = {
+            ingredient_recipe.ingredient_id: ingredient_recipe
+            for ingredient_recipe in IngredientRecipe.objects.filter(
+                recipe=recipe)
+        }
+        old_amounts = {ingredient_id: ingredient_recipe.amount
+                       for ingredient_id, ingredient_recipe
+                       in current.items()}
+        new_amounts = {ingredient_data['ingredient'].id:
+                       ingredient_data['amount']
+                       for ingredient_data in ingredients_data}
+        if new_amounts == old_amounts:
+            return
+
+        removed = [ingredient_recipe.id
+                   for ingredient_id, ingredient_recipe in current.items()
+                   if ingredient_id not in new_amounts]
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            ingredient_recipe = current.get(ingredient_id)
+            if ingredient_recipe is not None and (
+                    ingredient_recipe.amount != amount):
+                ingredient_recipe.amount = amount
+                changed.append(ingredient_recipe)
+        if removed:
+            IngredientRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in current
+        ])
+
+        # bulk_create и bulk_update не отправляют сигналы модели;
+        # удалённые ингредиенты вычтены из списков покупок сигналом
+        # pre_delete
+        ShoppingListItem.objects.update_recipe(
+            recipe.id,
+            {ingredient_id: amount
+             for ingredient_id, amount in old_amounts.items()
+             if ingredient_id in new_amounts},
+            new_amounts
+        )
+        invalidate_recipe_shopping_carts([recipe.id])
+        recipe_ingredients_changed([recipe.id])
+        getattr(recipe, '_prefetched_objects_cache', {}).pop(
+            'ingredients_amount', None)
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients_data = validated_data.pop('ingredients_amount')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.add(*tags)
         self.add_ingredients(recipe, ingredients_data)
+        similar_recipes_changed([recipe.id])
         return recipe
 
+    @staticmethod
+    def recipes_created(author, recipes):
+        """
+        bulk_create не отправляет post_save: то, что для одного рецепта
+        делают обработчики сигнала, для пакета выполняется пакетами
+        """
+        recipe_ids = [recipe.id for recipe in recipes]
+        User.objects.filter(pk=author.id).update(
+            recipes_count=F('recipes_count') + len(recipes))
+        update_search_vector(recipe_ids)
+        recipes_changed(recipe_ids)
+        if FeedItem.objects.is_fanned_out(author.id):
+            FeedItem.objects.fan_out(author.id, recipe_ids)
+        StoredFile.objects.acquire_many(
+            recipe.image.name for recipe in recipes if recipe.image)
+        enqueue_image_jobs(recipes)
+
+    @classmethod
+    @transaction.atomic
+    def bulk_create(cls, author, recipes_data):
+        """
+        Создать рецепты пакетом: рецепты, теги и ингредиенты
+        записываются массовыми вставками
+        """
+        recipes = [
+            Recipe(author=author, **{
+                field: value for field, value in data.items()
+                if field not in ('tags', 'ingredients_amount')
+            })
+            for data in recipes_data
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+            cls.recipes_created(author, recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+            for recipe, data in zip(recipes, recipes_data)
+            for tag in data['tags']
+        ])
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(recipe=recipe,
+                             ingredient=ingredient_data['ingredient'],
+                             amount=ingredient_data['amount'])
+            for recipe, data in zip(recipes, recipes_data)
+            for ingredient_data in data['ingredients_amount']
+        ])
+        recipe_ingredients_changed(recipe.id for recipe in recipes)
+        similar_recipes_changed(recipe.id for recipe in recipes)
+        return recipes
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         if 'tags' in validated_data:
-            tags = validated_data.pop('tags')
-            instance.tags.clear()
-            instance.tags.add(*tags)
+            tags = {tag.id for tag in validated_data.pop('tags')}
+            current_tags = {tag.id for tag in instance.tags.all()}
+            if current_tags - tags:
+                instance.tags.remove(*(current_tags - tags))
+            if tags - current_tags:
+                instance.tags.add(*(tags - current_tags))
         if 'ingredients_amount' in validated_data:
-            ingredients_data = validated_data.pop('ingredients_amount')
-            IngredientRecipe.objects.filter(recipe=instance).delete()
-            self.add_ingredients(instance, ingredients_data)
+            self.update_ingredients(
+                instance, validated_data.pop('ingredients_amount'))
+        similar_recipes_changed([instance.id])
         return super().update(instance, validated_data)
 
 
@@ -153,6 +394,7 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     tags = TagSerializer(many=True)
     image = Base64ImageField()
+    images = ImageVariantsField()
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -161,56 +403,74 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'text', 'cooking_time', 'image')
+                  'name', 'text', 'cooking_time', 'image', 'images',
+                  'image_status')
 
     def get_is_favorited(self, obj):
         request = self.context.get('request')
-        if not request.user.is_authenticated:
-            return False
-        return obj.is_favorited.filter(id=request.user.id).exists()
+        return obj.id in get_membership(request).favorites
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get('request')
-        if not request.user.is_authenticated:
-            return False
-        return obj.is_in_shopping_cart.filter(id=request.user.id).exists()
+        return obj.id in get_membership(request).shopping_cart
 
     def get_ingredients(self, obj):
         return IngredientRecipeSerializer(
             obj.ingredients_amount, many=True).data
 
 
+class AuthorSnapshotSerializer(UserSerializer):
+    is_subscribed = None
+
+    class Meta(UserSerializer.Meta):
+        fields = ('id', 'username', 'email', 'first_name', 'last_name')
+
+
+class RecipeSnapshotSerializer(RecipeGetSerializer):
+    """
+    Часть представления рецепта, одинаковая для всех пользователей
+    """
+    author = AuthorSnapshotSerializer(read_only=True)
+    is_favorited = None
+    is_in_shopping_cart = None
+
+    class Meta(RecipeGetSerializer.Meta):
+        fields = tuple(
+            field for field in RecipeGetSerializer.Meta.fields
+            if field not in ('is_favorited', 'is_in_shopping_cart')
+        )
+
+
 class RecipeReducedSerializer(serializers.ModelSerializer):
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'cooking_time', 'image')
+        fields = ('id', 'name', 'cooking_time', 'image', 'images')
 
 
 class SubscriptionSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count')
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def get_is_subscribed(self, obj):
         # Сериализатор используется только для авторов,
         # на которых подписан текущий пользователь
         return True
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        if request is not None:
-            recipes_limit = request.query_params.get('recipes_limit')
-            if recipes_limit is not None:
-                recipes = obj.recipes.all()[:int(recipes_limit)]
+        # Превью рецептов для страницы подписок загружается заранее
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
         else:
-            recipes = obj.recipes.all()
+            request = self.context.get('request')
+            recipes_limit = (get_recipes_limit(request)
+                             if request is not None else RECIPES_LIMIT_MAX)
+            recipes = obj.recipes.all()[:recipes_limit]
         serializer = RecipeReducedSerializer(recipes, many=True)
         return serializer.data
@@ -0,0 +1,78 @@
+import hashlib
+import io
+
+from django.core.cache import cache
+from django.db import transaction
+
+from users.models import User
+from .search import get_ingredients_version
+from .utils import create_pdf
+
+SHOPPING_CART_TIMEOUT = 60 * 60 * 24
+
+
+def shopping_cart_key(user_id):
+    # Версия ингредиентов входит в ключ: при переименовании ингредиента
+    # все ранее посчитанные списки покупок становятся неактуальными
+    return f'shopping_cart:{get_ingredients_version()}:{user_id}'
+
+
+def shopping_cart_pdf_key(digest):
+    return f'shopping_cart_pdf:{digest}'
+
+
+def get_shopping_cart_digest(user_id, shopping_cart):
+    """
+    Хэш содержимого списка покупок (ингредиент, единица, количество).
+    Посчитанный хэш хранится в кэше до изменения списка покупок.
+    """
+    key = shopping_cart_key(user_id)
+    digest = cache.get(key)
+    if digest is None:
+        digest = hashlib.sha256()
+        for item in shopping_cart:
+            digest.update(
+                f'{item["ingredient"]}\t{item["ingredient__name"]}\t'
+                f'{item["ingredient__measurement_unit"]}\t'
+                f'{item["amount"]}\n'.encode()
+            )
+        digest = digest.hexdigest()
+        cache.set(key, digest, SHOPPING_CART_TIMEOUT)
+    return digest
+
+
+def get_shopping_cart_pdf(digest, shopping_cart):
+    """
+    PDF списка покупок из кэша, одинаковые списки
+    разных пользователей используют одну запись
+    """
+    key = shopping_cart_pdf_key(digest)
+    content = cache.get(key)
+    if content is None:
+        buffer = io.BytesIO()
+        create_pdf(buffer, shopping_cart)
+        content = buffer.getvalue()
+        cache.set(key, content, SHOPPING_CART_TIMEOUT)
+    return content
+
+
+def invalidate_shopping_carts(user_ids):
+    """
+    Сбросить хэши списков покупок пользователей user_ids после фиксации
+    транзакции: загрузка, прочитавшая список до фиксации, иначе вернула
+    бы в кэш старый хэш
+    """
+    keys = [shopping_cart_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_recipe_shopping_carts(recipe_ids):
+    """
+    Сбросить списки покупок всех пользователей,
+    у которых рецепты recipe_ids лежат в корзине
+    """
+    invalidate_shopping_carts(
+        User.shopping_cart.through.objects.filter(
+            recipe_id__in=recipe_ids).values_list('user_id', flat=True)
+    )
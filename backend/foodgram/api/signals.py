@@ -0,0 +1,114 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            Subscription, Tag)
+from users.models import User
+from .authentication import invalidate_tokens
+from .catalog import bump_tags_version
+from .matching import recipe_ingredients_changed
+from .membership import membership_cache
+from .search import (bump_ingredients_version, ingredient_index,
+                     recipes_changed, update_search_vector)
+from .shopping_cart import (invalidate_recipe_shopping_carts,
+                            invalidate_shopping_carts)
+from .similar import similar_recipes_changed
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    bump_ingredients_version()
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_tags_version()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    update_search_vector([instance.pk])
+    recipes_changed([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_search_changed(sender, instance, **kwargs):
+    recipes_changed([instance.pk])
+    similar_recipes_changed([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.shopping_cart.through)
+def shopping_cart_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_shopping_carts([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_recipe_shopping_carts([instance.pk])
+    else:
+        invalidate_shopping_carts(pk_set)
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def ingredient_recipe_changed(sender, instance, **kwargs):
+    invalidate_recipe_shopping_carts([instance.recipe_id])
+    recipe_ingredients_changed([instance.recipe_id])
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    invalidate_recipe_shopping_carts([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.favourites.through)
+@receiver(m2m_changed, sender=User.shopping_cart.through)
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    field = ('favorites' if sender is User.favourites.through
+             else 'shopping_cart')
+    if action in ('post_add', 'post_remove'):
+        added = action == 'post_add'
+        if not reverse:
+            membership_cache.changed(instance.pk, field, pk_set, added)
+            return
+        for user_id in pk_set:
+            membership_cache.changed(user_id, field, [instance.pk], added)
+    elif action == 'pre_clear':
+        if not reverse:
+            membership_cache.invalidate([instance.pk])
+            return
+        membership_cache.invalidate(sender.objects.filter(
+            recipe_id=instance.pk).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(sender, instance, created, **kwargs):
+    if created:
+        membership_cache.changed(instance.user_id, 'subscriptions',
+                                 [instance.author_id], True)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    membership_cache.changed(instance.user_id, 'subscriptions',
+                             [instance.author_id], False)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    # Пользователь хранится в кэше токенов вместе с токеном:
+    # после деактивации, смены пароля и других изменений
+    # он загружается заново
+    invalidate_tokens(Token.objects.filter(
+        user_id=instance.pk).values_list('key', flat=True))
@@ -0,0 +1,258 @@
+import os
+import pickle
+import random
+import threading
+import zlib
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from recipes.models import IngredientRecipe, Recipe
+
+# Параметры MinHash/LSH: NUM_PERM значений в подписи делятся
+# на BANDS полос по ROWS значений. Рецепты попадают в кандидаты,
+# если совпадает хотя бы одна полоса: при сходстве по Жаккару s
+# вероятность этого 1 - (1 - s ** ROWS) ** BANDS, порог около 0.25
+NUM_PERM = 32
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MINHASH_SEED = 42
+MERSENNE_PRIME = (1 << 31) - 1
+SIMILAR_RECIPES_LIMIT = 10
+SIMILAR_RECIPES_MAX = 50
+INDEX_FORMAT = (NUM_PERM, BANDS, MINHASH_SEED)
+
+_random = random.Random(MINHASH_SEED)
+PERMUTATIONS = [
+    (_random.randrange(1, MERSENNE_PRIME), _random.randrange(MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+
+def index_path():
+    return settings.SIMILAR_RECIPES_INDEX
+
+
+def log_path():
+    return f'{settings.SIMILAR_RECIPES_INDEX}.log'
+
+
+def minhash(features):
+    """
+    Подпись множества признаков: для каждой перестановки -
+    минимальное значение хэша признака
+    """
+    hashes = [zlib.crc32(feature.encode()) % MERSENNE_PRIME
+              for feature in features]
+    if not hashes:
+        return None
+    return array('I', (
+        min((a * value + b) % MERSENNE_PRIME for value in hashes)
+        for a, b in PERMUTATIONS
+    ))
+
+
+def recipe_features(recipe_ids=None):
+    """
+    Признаки рецептов: ингредиенты и теги, {recipe_id: set}
+    """
+    ingredients = IngredientRecipe.objects.all()
+    tags = Recipe.tags.through.objects.all()
+    if recipe_ids is not None:
+        ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+        tags = tags.filter(recipe_id__in=recipe_ids)
+    features = defaultdict(set)
+    for recipe_id, ingredient_id in ingredients.values_list(
+            'recipe_id', 'ingredient_id').iterator():
+        features[recipe_id].add(f'i{ingredient_id}')
+    for recipe_id, tag_id in tags.values_list(
+            'recipe_id', 'tag_id').iterator():
+        features[recipe_id].add(f't{tag_id}')
+    return features
+
+
+def recipe_signatures(recipe_ids=None):
+    return {recipe_id: minhash(features) for recipe_id, features
+            in recipe_features(recipe_ids).items()}
+
+
+def log_state():
+    """
+    Файл журнала и его размер: при построении индекса журнал заменяется
+    """
+    try:
+        stat = os.stat(log_path())
+    except FileNotFoundError:
+        return None, 0
+    return stat.st_ino, stat.st_size
+
+
+def build_snapshot():
+    """
+    Построить подписи всех рецептов и записать их в файл индекса.
+    Изменения, записанные в журнал во время построения, остаются в нём
+    """
+    _, log_offset = log_state()
+    signatures = recipe_signatures()
+    path = index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ids = array('Q', signatures)
+    values = array('I')
+    for recipe_id in ids:
+        values.extend(signatures[recipe_id])
+    with open(f'{path}.tmp', 'wb') as file:
+        pickle.dump({'format': INDEX_FORMAT, 'ids': ids.tobytes(),
+                     'signatures': values.tobytes()}, file,
+                    pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+    if log_offset:
+        with open(log_path()) as file:
+            file.seek(log_offset)
+            remainder = file.read()
+        with open(f'{log_path()}.tmp', 'w') as file:
+            file.write(remainder)
+        os.replace(f'{log_path()}.tmp', log_path())
+    return len(ids)
+
+
+def read_snapshot(path):
+    with open(path, 'rb') as file:
+        data = pickle.load(file)
+    if data['format'] != INDEX_FORMAT:
+        return None
+    ids = array('Q')
+    ids.frombytes(data['ids'])
+    values = array('I')
+    values.frombytes(data['signatures'])
+    return {recipe_id: values[position * NUM_PERM:
+                              (position + 1) * NUM_PERM]
+            for position, recipe_id in enumerate(ids)}
+
+
+def append_changes(recipe_ids):
+    signatures = recipe_signatures(recipe_ids)
+    lines = ''.join(
+        f'{recipe_id} {signatures[recipe_id].tobytes().hex()}\n'
+        if signatures.get(recipe_id) is not None else f'{recipe_id} -\n'
+        for recipe_id in recipe_ids
+    )
+    os.makedirs(os.path.dirname(log_path()), exist_ok=True)
+    with open(log_path(), 'a') as file:
+        file.write(lines)
+
+
+def similar_recipes_changed(recipe_ids):
+    """
+    Записать в журнал индекса новые подписи рецептов recipe_ids
+    (или их удаление) после фиксации транзакции
+    """
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: append_changes(recipe_ids))
+
+
+class SimilarRecipesIndex:
+    """
+    Индекс MinHash/LSH похожих рецептов в памяти процесса.
+    Загружается из файла, построенного командой build_similar_recipes
+    (если файла нет - строится по БД), затем применяет новые строки
+    журнала изменений. Файл и журнал проверяются при каждом запросе.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._snapshot = None
+        self._log = None
+        self._log_offset = 0
+        self._signatures = {}
+        self._buckets = defaultdict(set)
+
+    @staticmethod
+    def band_keys(signature):
+        data = signature.tobytes()
+        size = len(data) // BANDS
+        return [bytes([band]) + data[band * size:(band + 1) * size]
+                for band in range(BANDS)]
+
+    def _set(self, recipe_id, signature):
+        previous = self._signatures.pop(recipe_id, None)
+        if previous is not None:
+            for key in self.band_keys(previous):
+                self._buckets[key].discard(recipe_id)
+        if signature is not None:
+            self._signatures[recipe_id] = signature
+            for key in self.band_keys(signature):
+                self._buckets[key].add(recipe_id)
+
+    def _load(self, snapshot, log):
+        self._signatures = {}
+        self._buckets = defaultdict(set)
+        self._log = log
+        self._log_offset = 0
+        signatures = None
+        if snapshot is not None:
+            signatures = read_snapshot(index_path())
+        if signatures is None:
+            signatures = recipe_signatures()
+        for recipe_id, signature in signatures.items():
+            self._set(recipe_id, signature)
+        self._snapshot = snapshot
+        self._loaded = True
+
+    def _replay(self):
+        with open(log_path()) as file:
+            file.seek(self._log_offset)
+            for line in file:
+                if not line.endswith('\n'):
+                    # Строка ещё дописывается
+                    break
+                self._log_offset += len(line)
+                recipe_id, value = line.split()
+                signature = None
+                if value != '-':
+                    signature = array('I')
+                    signature.frombytes(bytes.fromhex(value))
+                self._set(int(recipe_id), signature)
+
+    def sync(self):
+        try:
+            stat = os.stat(index_path())
+            snapshot = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            snapshot = None
+        log, size = log_state()
+        with self._lock:
+            if (not self._loaded or snapshot != self._snapshot
+                    or log != self._log):
+                self._load(snapshot, log)
+            if size > self._log_offset:
+                self._replay()
+
+    def similar(self, recipe_id, limit=SIMILAR_RECIPES_LIMIT):
+        """
+        Рецепты, похожие на recipe_id: список (id, оценка сходства
+        по Жаккару), по убыванию сходства
+        """
+        self.sync()
+        with self._lock:
+            signature = self._signatures.get(recipe_id)
+            if signature is None:
+                return []
+            candidates = set().union(*(
+                self._buckets.get(key, ())
+                for key in self.band_keys(signature)))
+            candidates.discard(recipe_id)
+            scores = {
+                candidate: sum(
+                    a == b for a, b in zip(signature,
+                                           self._signatures[candidate])
+                ) / NUM_PERM
+                for candidate in candidates
+            }
+        return sorted(scores.items(),
+                      key=lambda item: (-item[1], -item[0]))[:limit]
+
+
+similar_recipes_index = SimilarRecipesIndex()
@@ -0,0 +1,82 @@
+from django.core.cache import cache
+
+from recipes.models import Recipe
+from .serializers import RecipeGetSerializer, RecipeSnapshotSerializer
+
+SNAPSHOT_TIMEOUT = 60 * 60 * 24
+SNAPSHOT_HITS_KEY = 'recipe_snapshots:hits'
+SNAPSHOT_MISSES_KEY = 'recipe_snapshots:misses'
+# Поля представления рецепта, зависящие от пользователя,
+# и соответствующие им поля validator_rows
+VIEWER_FLAGS = {
+    'is_favorited': 'viewer_favorited',
+    'is_in_shopping_cart': 'viewer_in_shopping_cart',
+}
+
+
+def snapshot_key(base_url, row):
+    # Адреса изображений в представлении абсолютные
+    return (f'recipe_snapshot:{base_url}:{row["id"]}:'
+            f'{row["modified"].isoformat()}')
+
+
+def count(key, value):
+    if not value:
+        return
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        # Счётчик вытеснен из кэша
+        pass
+
+
+def get_snapshot_stats():
+    hits = cache.get(SNAPSHOT_HITS_KEY, 0)
+    misses = cache.get(SNAPSHOT_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def add_viewer_flags(snapshot, row):
+    data = {}
+    for field in RecipeGetSerializer.Meta.fields:
+        if field in VIEWER_FLAGS:
+            data[field] = bool(row.get(VIEWER_FLAGS[field], False))
+        elif field == 'author':
+            data[field] = dict(snapshot[field], is_subscribed=bool(
+                row.get('viewer_subscribed', False)))
+        else:
+            data[field] = snapshot[field]
+    return data
+
+
+def render_recipes(rows, request):
+    """
+    Представления рецептов rows (см. validator_rows): общая часть
+    берётся из кэша по id и времени изменения рецепта, недостающие
+    создаются одной выборкой, флаги пользователя добавляются из rows
+    """
+    base_url = request.build_absolute_uri('/')
+    keys = {row['id']: snapshot_key(base_url, row) for row in rows}
+    snapshots = cache.get_many(list(keys.values()))
+    missing = [pk for pk, key in keys.items() if key not in snapshots]
+    count(SNAPSHOT_HITS_KEY, len(keys) - len(missing))
+    count(SNAPSHOT_MISSES_KEY, len(missing))
+    if missing:
+        recipes = Recipe.objects.filter(pk__in=missing).select_related(
+            'author').prefetch_related('tags',
+                                       'ingredients_amount__ingredient')
+        created = {
+            keys[item['id']]: item
+            for item in RecipeSnapshotSerializer(
+                recipes, many=True, context={'request': request}).data
+        }
+        cache.set_many(created, SNAPSHOT_TIMEOUT)
+        snapshots.update(created)
+    return [add_viewer_flags(snapshots[keys[row['id']]], row)
+            for row in rows if keys[row['id']] in snapshots]
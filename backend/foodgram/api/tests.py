@@ -0,0 +1,172 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            Subscription, Tag)
+from users.models import User
+from .authentication import token_cache
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+RECIPES_COUNT = 12
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeListQueriesTest(TestCase):
+    """
+    Число запросов к БД для страницы рецептов не зависит от её размера
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com',
+                username=f'user{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='password-12345',
+            )
+            for number in range(3)
+        ]
+        tags = [Tag.objects.create(name=f'Тег {number}',
+                                   slug=f'tag{number}', color='#FF0000')
+                for number in range(3)]
+        ingredients = [Ingredient.objects.create(
+            name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(6)]
+        recipes = []
+        for number in range(RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}',
+                text=f'Описание рецепта {number}',
+                cooking_time=10,
+                image=f'recipes/{number}.png',
+                author=cls.users[number % len(cls.users)],
+            )
+            recipe.tags.add(tags[number % 3], tags[(number + 1) % 3])
+            recipes.append(recipe)
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(recipe=recipe,
+                             ingredient=ingredients[(number + shift) % 6],
+                             amount=10 + shift)
+            for number, recipe in enumerate(recipes)
+            for shift in range(3)
+        ])
+        cls.users[0].favourites.add(*recipes[::2])
+        cls.users[0].shopping_cart.add(*recipes[::3])
+        Subscription.objects.create(user=cls.users[0], author=cls.users[1])
+
+    def assert_page_queries(self, client, cold, warm):
+        for limit in (3, 10):
+            with self.subTest(limit=limit):
+                cache.clear()
+                with self.assertNumQueries(cold):
+                    response = client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(len(response.data['results']), limit)
+                # Представления рецептов уже в кэше
+                with self.assertNumQueries(warm):
+                    response = client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous_page_queries(self):
+        self.assert_page_queries(APIClient(), cold=6, warm=2)
+
+    def test_authenticated_page_queries(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        self.assert_page_queries(client, cold=9, warm=2)
+
+    def test_viewer_flags(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.get('/api/recipes/', {'limit': RECIPES_COUNT})
+        favorites = set(self.users[0].favourites.values_list(
+            'id', flat=True))
+        for item in response.data['results']:
+            self.assertEqual(item['is_favorited'], item['id'] in favorites)
+            self.assertEqual(item['author']['is_subscribed'],
+                             item['author']['id'] == self.users[1].id)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeETagTest(TestCase):
+    """
+    ETag рецепта меняется при изменении его ингредиентов
+    """
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com',
+            username='author',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password-12345',
+        )
+        cls.recipe = Recipe.objects.create(
+            name='Омлет',
+            text='Взбить яйца и пожарить',
+            cooking_time=10,
+            image='recipes/omelette.png',
+            author=author,
+        )
+        cls.ingredient_recipe = IngredientRecipe.objects.create(
+            recipe=cls.recipe,
+            ingredient=Ingredient.objects.create(name='Яйца',
+                                                 measurement_unit='шт'),
+            amount=3,
+        )
+
+    def test_ingredient_changed(self):
+        client = APIClient()
+        url = f'/api/recipes/{self.recipe.id}/'
+        etag = client.get(url)['ETag']
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag)
+                         .status_code, 304)
+        # Изменение напрямую, как в админке
+        self.ingredient_recipe.amount = 4
+        self.ingredient_recipe.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['ingredients'][0]['amount'], 4)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CachedTokenAuthenticationTest(TestCase):
+    """
+    Пользователь из кэша токенов не перезаписывает счётчики в БД
+    """
+    def setUp(self):
+        cache.clear()
+        token_cache.discard(list(token_cache._entries))
+        self.user = User.objects.create_user(
+            email='user@example.com',
+            username='user',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password-12345',
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects
+                                .create(user=self.user).key)
+
+    def test_counters_kept_on_save(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(recipes_count=1,
+                                                    followers_count=2)
+        with self.assertNumQueries(0):
+            self.client.get('/api/users/me/')
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password-12345',
+            'new_password': 'new-password-67890',
+        }, format='json')
+        self.assertEqual(response.status_code, 204, response.data)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('new-password-67890'))
+        self.assertEqual((self.user.recipes_count,
+                          self.user.followers_count), (1, 2))
@@ -1,63 +1,298 @@
+import csv
+import json
 import os
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from recipes.models import Recipe
+
+RECIPES_LIMIT_MAX = 20
+# Наибольшее число id в условии IN; большие множества id
+# проверяются подзапросом в СУБД
+IN_LIST_MAX = 500
+RECIPES_BATCH_MAX = 100
+FONT_NAME = 'Verdana'
+PDF_LINES_PER_PAGE = 30
+
+
+def get_version(key):
+    """
+    Версия данных в кэше Django. Начальное значение случайное, чтобы
+    после вытеснения ключа из кэша версии не повторялись
+    """
+    cache.add(key, random.getrandbits(48), None)
+    return cache.get(key)
+
+
+def bump_version(key):
+    """
+    Увеличить версию key и вернуть новую; None, если ключ вытеснен
+    из кэша: версия заново получает случайное значение
+    """
+    cache.add(key, random.getrandbits(48), None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_version(key)
+        return None
+
+
+class TTLCache:
+    """
+    Записи (версия, срок, значение) в памяти процесса: не больше maxsize,
+    вытесняются по LRU и после срока; срок по умолчанию — ttl секунд
+    по часам timer
+    """
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def lookup(self, key):
+        """
+        Запись key, если она есть и её срок не истёк; иначе None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self.timer():
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key, version, value, expires=None):
+        if expires is None:
+            expires = self.timer() + self.ttl
+        with self._lock:
+            self._entries[key] = (version, expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
 
 def related_field_add_remove(obj, related_field, request, serializer,
                              error_message_get, error_message_delete):
+    """
+    Добавить (GET) или удалить (DELETE) пользователя в связи рецепта
+    related_field. Наличие связи проверяется по Membership пользователя,
+    которое обновляется сигналом m2m_changed
+    """
+    # membership использует get_version и TTLCache этого модуля
+    from .membership import RECIPE_RELATED_FIELDS, get_membership
+
     queryset = getattr(obj, related_field, None)
-    if queryset is None:
+    if queryset is None or related_field not in RECIPE_RELATED_FIELDS:
         return Response(status=status.HTTP_400_BAD_REQUEST)
+    linked = obj.id in getattr(get_membership(request),
+                               RECIPE_RELATED_FIELDS[related_field])
     if request.method == 'GET':
-        if queryset.filter(id=request.user.id).exists():
+        if linked:
             return Response(error_message_get,
                             status=status.HTTP_400_BAD_REQUEST)
         queryset.add(request.user)
         serializer = serializer(obj)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     if request.method == 'DELETE':
-        if not queryset.filter(id=request.user.id).exists():
+        if not linked:
             return Response(error_message_delete,
                             status=status.HTTP_400_BAD_REQUEST)
         queryset.remove(request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@transaction.atomic
+def related_field_batch(request, related_field):
+    """
+    Добавить (POST) или удалить (DELETE) пакет рецептов ids
+    в связи пользователя related_field одной вставкой или удалением
+    """
+    ids = request.data.get('ids') if isinstance(request.data, dict) else None
+    if not isinstance(ids, list) or not all(
+            isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+        raise ValidationError({'ids': 'Ожидается список id рецептов.'})
+    if len(ids) > RECIPES_BATCH_MAX:
+        raise ValidationError(
+            {'ids': f'Можно указать не более {RECIPES_BATCH_MAX} рецептов.'})
+
+    queryset = getattr(request.user, related_field)
+    found = set(Recipe.objects.filter(id__in=ids).values_list(
+        'id', flat=True))
+    linked = set(queryset.filter(id__in=found).values_list('id', flat=True))
+    if request.method == 'POST':
+        changed = found - linked
+        queryset.add(*changed)
+    else:
+        changed = linked
+        queryset.remove(*changed)
+    return Response({
+        'changed': sorted(changed),
+        'unchanged': sorted(found - changed),
+        'not_found': sorted(set(ids) - found),
+    })
+
+
+def get_limit_param(request, param, maximum, default=None):
+    """
+    Проверенное целочисленное значение параметра запроса,
+    не больше maximum
+    """
+    value = request.query_params.get(param)
+    if value is None:
+        return maximum if default is None else default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({param: 'Укажите целое число.'})
+    if value < 0:
+        raise ValidationError(
+            {param: 'Нельзя указывать отрицательное число.'})
+    return min(value, maximum)
+
+
+def get_ids_param(request, param):
+    """
+    Список id из параметра запроса: через запятую или повтором параметра
+    """
+    values = [value for item in request.query_params.getlist(param)
+              for value in item.split(',') if value]
+    try:
+        return [int(value) for value in values]
+    except ValueError:
+        raise ValidationError({param: 'Укажите целые числа через запятую.'})
+
+
+def get_recipes_limit(request):
+    return get_limit_param(request, 'recipes_limit', RECIPES_LIMIT_MAX)
+
+
+def get_recipes_preview(authors, recipes_limit):
+    """
+    Последние recipes_limit рецептов каждого автора одним запросом:
+    рецепты нумеруются внутри автора оконной функцией
+    """
+    windowed = Recipe.objects.filter(author__in=authors).annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=F('id').desc(),
+        )
+    ).order_by().values(
+        'id', 'name', 'cooking_time', 'image', 'image_status', 'author_id',
+        'row_number')
+    sql, params = windowed.query.sql_with_params()
+    recipes = Recipe.objects.raw(
+        f'SELECT * FROM ({sql}) AS preview '
+        'WHERE row_number <= %s ORDER BY author_id, row_number',
+        (*params, recipes_limit)
+    )
+    preview = defaultdict(list)
+    for recipe in recipes:
+        preview[recipe.author_id].append(recipe)
+    return preview
+
+
+def register_font():
+    """
+    Шрифт регистрируется в ReportLab один раз на процесс
+    """
+    if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        font = os.path.join(settings.BASE_DIR, 'fonts/Verdana.ttf')
+        pdfmetrics.registerFont(TTFont(FONT_NAME, font))
+
+
 def create_pdf(buffer, shopping_cart):
 
     def set_style(pdf, text):
-        pdf.setFont('Verdana', 20)
+        pdf.setFont(FONT_NAME, 20)
         pdf.drawCentredString(300, 770, 'СПИСОК ПОКУПОК')
         pdf.line(30, 750, 550, 750)
-        text.setFont('Verdana', 12)
+        text.setFont(FONT_NAME, 12)
         text.setLeading(18)
 
     def make_content(pdf, shopping_cart):
-        pages = [shopping_cart[x:x + 30] for x in range(
-            0, len(shopping_cart), 30)]
-
-        font = os.path.join(settings.BASE_DIR, 'fonts/Verdana.ttf')
-        pdfmetrics.registerFont(TTFont('Verdana', font))
-        item_index = 1
-
-        for page in pages:
-            text = pdf.beginText(40, 680)
-            set_style(pdf, text)
-
-            for item in page:
-                text.textLine(
-                    f'{item_index}. {item["ingredient__name"].capitalize()} — '
-                    f'{item["amount"]} {item["ingredient__measurement_unit"]}'
-                )
-                item_index += 1
+        text = None
+        for item_index, item in enumerate(shopping_cart, start=1):
+            if text is None:
+                text = pdf.beginText(40, 680)
+                set_style(pdf, text)
+            text.textLine(shopping_cart_line(item_index, item).rstrip())
+            if item_index % PDF_LINES_PER_PAGE == 0:
+                pdf.drawText(text)
+                pdf.showPage()
+                text = None
+        if text is not None:
             pdf.drawText(text)
             pdf.showPage()
 
+    register_font()
     pdf = canvas.Canvas(buffer)
     make_content(pdf, shopping_cart)
     pdf.save()
+
+
+def shopping_cart_line(item_index, item):
+    return (f'{item_index}. {item["ingredient__name"].capitalize()} — '
+            f'{item["amount"]} {item["ingredient__measurement_unit"]}\n')
+
+
+def shopping_cart_txt(shopping_cart):
+    yield 'СПИСОК ПОКУПОК\n\n'
+    for item_index, item in enumerate(shopping_cart, start=1):
+        yield shopping_cart_line(item_index, item)
+
+
+class Echo:
+    """
+    Псевдобуфер для csv.writer: строка возвращается, а не записывается
+    """
+    def write(self, value):
+        return value
+
+
+def shopping_cart_csv(shopping_cart):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['name', 'measurement_unit', 'amount'])
+    for item in shopping_cart:
+        yield writer.writerow([item['ingredient__name'],
+                               item['ingredient__measurement_unit'],
+                               item['amount']])
+
+
+def shopping_cart_json(shopping_cart):
+    separator = '['
+    for item in shopping_cart:
+        yield separator + json.dumps({
+            'name': item['ingredient__name'],
+            'measurement_unit': item['ingredient__measurement_unit'],
+            'amount': item['amount'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+# Текстовые форматы списка покупок отдаются потоком
+SHOPPING_CART_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', shopping_cart_txt),
+    'csv': ('text/csv; charset=utf-8', shopping_cart_csv),
+    'json': ('application/json', shopping_cart_json),
+}
@@ -1,27 +1,46 @@
 import io
+import sys
+from calendar import timegm
 
-from django.db.models import Sum
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django_filters import rest_framework as filters
 from djoser.views import UserViewSet as BaseUserViewSet
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
 
-from recipes.models import (Ingredient, IngredientRecipe,
-                            Recipe, Subscription, Tag)
+from recipes.models import (FeedItem, Ingredient, Recipe, ShoppingListItem,
+                            Subscription, Tag)
 from users.models import User
+from .catalog import catalog_response, get_tags_version
+from .conditional import recipes_etag, validator_rows, viewer_rows
 from .filters import RecipeFilterSet
+from .matching import recipe_ingredient_index
+from .membership import get_membership
 from .mixins import ListRetrieveViewSet
-from .pagination import CustomPagination
+from .negotiation import IgnoreFormatContentNegotiation
+from .pagination import (CustomPagination, FeedCursorPagination,
+                         LimitPageNumberPagination)
 from .permissions import IsAuthorOrStaffOrReadOnly
+from .search import (INGREDIENTS_SEARCH_LIMIT, fuzzy_search,
+                     get_ingredients_version, ingredient_index)
 from .serializers import (IngredientSerializer, RecipeCreateSerializer,
                           RecipeGetSerializer, RecipeReducedSerializer,
-                          SubscriptionSerializer, TagSerializer)
-from .utils import create_pdf, related_field_add_remove
+                          SubscriptionSerializer, TagSerializer,
+                          get_referenced_objects)
+from .shopping_cart import get_shopping_cart_digest, get_shopping_cart_pdf
+from .similar import (SIMILAR_RECIPES_LIMIT, SIMILAR_RECIPES_MAX,
+                      similar_recipes_index)
+from .snapshots import get_snapshot_stats, render_recipes
+from .utils import (RECIPES_BATCH_MAX, SHOPPING_CART_FORMATS, get_ids_param,
+                    get_limit_param, get_recipes_limit, get_recipes_preview,
+                    related_field_add_remove, related_field_batch)
 
 
 class UserViewSet(BaseUserViewSet):
@@ -43,8 +62,11 @@ class UserViewSet(BaseUserViewSet):
         Подписаться/отписаться от пользователя
         """
         author = self.get_object()
+        # Подписки пользователя - из его Membership, изменения
+        # применяются к нему сигналами Subscription
+        subscribed = author.id in get_membership(request).subscriptions
         if request.method == 'GET':
-            if author.subscribed_users.filter(user=request.user).exists():
+            if subscribed:
                 return Response(
                     f'Вы уже подписаны на пользователя {author.username}',
                     status=status.HTTP_400_BAD_REQUEST
@@ -54,7 +76,7 @@ class UserViewSet(BaseUserViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            if not author.subscribed_users.filter(user=request.user).exists():
+            if not subscribed:
                 return Response(
                     f'Вы не подписаны на пользователя {author.username}',
                     status=status.HTTP_400_BAD_REQUEST
@@ -70,15 +92,21 @@ class UserViewSet(BaseUserViewSet):
         """
         Подписки пользователя
         """
-        authors = User.objects.filter(subscribed_users__user=request.user)
+        recipes_limit = get_recipes_limit(request)
+        authors = User.objects.filter(
+            subscribed_users__user=request.user).order_by('-id')
         page = self.paginate_queryset(authors)
         if page is not None:
-            serializer = SubscriptionSerializer(
-                page, context={'request': self.request}, many=True)
-            return self.get_paginated_response(serializer.data)
+            authors = page
+        authors = list(authors)
+        recipes_preview = get_recipes_preview(authors, recipes_limit)
+        for author in authors:
+            author.recipes_preview = recipes_preview[author.id]
         serializer = SubscriptionSerializer(
             authors, context={'request': self.request}, many=True)
-        return self.get_paginated_response(serializer.data)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
 
 
 class IngredientViewSet(ListRetrieveViewSet):
@@ -86,8 +114,29 @@ class IngredientViewSet(ListRetrieveViewSet):
     serializer_class = IngredientSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
-    filter_backends = (SearchFilter,)
-    search_fields = ('^name',)
+    # Справочник одинаков для всех пользователей
+    authentication_classes = ()
+
+    def list(self, request, *args, **kwargs):
+        """
+        Все ингредиенты - из снимка справочника в кэше.
+        Поиск ингредиентов по названию (параметр name):
+        mode=prefix - по началу названия, по индексу в памяти,
+        mode=fuzzy - нечёткий поиск с ранжированием результатов
+        """
+        name = request.query_params.get('name')
+        if name is None:
+            return catalog_response(
+                request, 'ingredients', get_ingredients_version(),
+                lambda: self.get_serializer(
+                    self.get_queryset(), many=True).data)
+        limit = get_limit_param(request, 'limit', INGREDIENTS_SEARCH_LIMIT)
+        mode = request.query_params.get('mode', 'prefix')
+        if mode == 'prefix':
+            return Response(ingredient_index.prefix(name, limit))
+        if mode == 'fuzzy':
+            return Response(fuzzy_search(name, limit))
+        raise ValidationError({'mode': 'Допустимые значения: prefix, fuzzy.'})
 
 
 class TagViewSet(ListRetrieveViewSet):
@@ -95,6 +144,12 @@ class TagViewSet(ListRetrieveViewSet):
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def list(self, request, *args, **kwargs):
+        return catalog_response(
+            request, 'tags', get_tags_version(),
+            lambda: self.get_serializer(self.get_queryset(), many=True).data)
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -104,6 +159,71 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = RecipeFilterSet
 
+    def get_queryset(self):
+        """
+        Рецепты страницы со всеми связями, чтобы сериализатор не обращался
+        к БД для каждого рецепта. Флаги текущего пользователя берутся
+        из его Membership
+        """
+        return Recipe.objects.prefetch_related(
+            'tags', 'ingredients_amount__ingredient', 'author')
+
+    def list(self, request, *args, **kwargs):
+        """
+        Список рецептов со слабым ETag: сначала выбираются только id,
+        время изменения и флаги пользователя рецептов страницы,
+        и если ETag совпадает с If-None-Match, рецепты не загружаются.
+        Представления рецептов берутся из кэша, см. render_recipes
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = viewer_rows(
+            self.paginate_queryset(validator_rows(queryset)), request)
+        etag = recipes_etag(rows, request.user,
+                            self.paginator.get_page_state(), weak=True)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.get_paginated_response(
+                render_recipes(rows, request))
+        response['ETag'] = etag
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Рецепт с ETag и, для анонимных пользователей, Last-Modified:
+        условный запрос проверяется по одной выборке по первичному ключу
+        """
+        try:
+            row = validator_rows(
+                Recipe.objects.filter(pk=kwargs[self.lookup_field])).first()
+        except (TypeError, ValueError):
+            row = None
+        if row is None:
+            return super().retrieve(request, *args, **kwargs)
+        row = viewer_rows([row], request)[0]
+        etag = recipes_etag([row], request.user)
+        last_modified = None
+        if not request.user.is_authenticated:
+            # Флаги пользователя меняются без изменения рецепта,
+            # поэтому для них достаточно только ETag
+            last_modified = timegm(row['modified'].utctimetuple())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = Response(render_recipes([row], request)[0])
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_validator_rows(self, recipe_ids):
+        """
+        validator_rows рецептов recipe_ids в том же порядке
+        """
+        rows = {row['id']: row for row in validator_rows(
+            Recipe.objects.filter(pk__in=recipe_ids))}
+        return viewer_rows([rows[pk] for pk in recipe_ids if pk in rows],
+                           self.request)
+
     def get_serializer_class(self):
         if self.request.method in permissions.SAFE_METHODS:
             return RecipeGetSerializer
@@ -115,6 +235,135 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(detail=False,
+            methods=['POST'],
+            permission_classes=(IsAuthenticated,))
+    def batch(self, request):
+        """
+        Создать несколько рецептов одним запросом.
+        По умолчанию при ошибке в любом рецепте не создаётся ни один,
+        с параметром partial=true создаются все корректные рецепты
+        """
+        recipes_data = request.data
+        if not isinstance(recipes_data, list):
+            raise ValidationError('Ожидается список рецептов.')
+        if len(recipes_data) > RECIPES_BATCH_MAX:
+            raise ValidationError(
+                f'Можно создать не более {RECIPES_BATCH_MAX} рецептов '
+                'за один запрос.')
+        partial = request.query_params.get('partial') in ('1', 'true')
+
+        context = self.get_serializer_context()
+        context.update(get_referenced_objects(recipes_data))
+        context['existing_recipes'] = set(Recipe.objects.filter(name__in=[
+            data.get('name') for data in recipes_data
+            if isinstance(data, dict)
+        ]).values_list('name', 'text'))
+
+        valid, errors = [], []
+        for index, data in enumerate(recipes_data):
+            serializer = RecipeCreateSerializer(data=data, context=context)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            key = (serializer.validated_data['name'],
+                   serializer.validated_data['text'])
+            if key in context['existing_recipes']:
+                errors.append({'index': index, 'errors': {
+                    'non_field_errors': ['Такой рецепт уже существует']}})
+                continue
+            context['existing_recipes'].add(key)
+            valid.append((index, serializer.validated_data))
+
+        if errors and not partial:
+            return Response({'created': [], 'errors': errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        recipes = RecipeCreateSerializer.bulk_create(
+            request.user, [data for _, data in valid])
+        created = [{'index': index, 'id': recipe.id}
+                   for (index, _), recipe in zip(valid, recipes)]
+        return Response(
+            {'created': created, 'errors': errors},
+            status=(status.HTTP_201_CREATED if created
+                    else status.HTTP_400_BAD_REQUEST)
+        )
+
+    @action(detail=False,
+            methods=['GET'],
+            pagination_class=LimitPageNumberPagination)
+    def cook(self, request):
+        """
+        Рецепты из имеющихся ингредиентов (параметр ingredients):
+        для каждого рецепта - сколько его ингредиентов есть (matched)
+        и скольких не хватает (missing), сначала рецепты с наименьшим
+        числом недостающих. max_missing ограничивает число недостающих
+        """
+        ingredient_ids = get_ids_param(request, 'ingredients')
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Укажите хотя бы один ингредиент.'})
+        max_missing = get_limit_param(request, 'max_missing', sys.maxsize)
+        results = recipe_ingredient_index.coverage(ingredient_ids,
+                                                   max_missing)
+        page = self.paginate_queryset(results)
+        if page is not None:
+            results = page
+        counts = {recipe_id: (matched, missing)
+                  for recipe_id, matched, missing in results}
+        data = render_recipes(self.get_validator_rows(counts), request)
+        for item in data:
+            item['matched'], item['missing'] = counts[item['id']]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    @action(detail=False,
+            methods=['GET'],
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """
+        Лента: последние рецепты авторов, на которых подписан
+        пользователь, с постраничным выводом по курсору
+        """
+        paginator = FeedCursorPagination()
+        recipe_ids = paginator.paginate_feed(
+            lambda before, limit: FeedItem.objects.recipe_ids(
+                request.user, before, limit),
+            request
+        )
+        return paginator.get_paginated_response(
+            render_recipes(self.get_validator_rows(recipe_ids), request))
+
+    @action(detail=False,
+            methods=['GET'],
+            permission_classes=(IsAdminUser,))
+    def cache_stats(self, request):
+        """
+        Доля представлений рецептов, взятых из кэша
+        """
+        return Response(get_snapshot_stats())
+
+    @action(detail=True, methods=['GET'])
+    def similar(self, request, **kwargs):
+        """
+        Похожие рецепты по ингредиентам и тегам (параметр limit),
+        с оценкой сходства similarity
+        """
+        recipe = self.get_object()
+        limit = get_limit_param(request, 'limit', SIMILAR_RECIPES_MAX,
+                                SIMILAR_RECIPES_LIMIT)
+        results = similar_recipes_index.similar(recipe.id, limit)
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _ in results])
+        results = [(recipes[recipe_id], score)
+                   for recipe_id, score in results if recipe_id in recipes]
+        data = RecipeReducedSerializer(
+            [recipe for recipe, _ in results], many=True,
+            context=self.get_serializer_context()).data
+        for item, (_, score) in zip(data, results):
+            item['similarity'] = score
+        return Response(data)
+
     @action(detail=True,
             methods=['GET', 'DELETE'],
             permission_classes=(IsAuthenticated,))
@@ -158,20 +407,63 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
 
     @action(detail=False,
-            methods=['GET'],
+            methods=['POST', 'DELETE'],
+            url_path='favorite',
             permission_classes=(IsAuthenticated,))
+    def favorite_batch(self, request):
+        """
+        Добавить/удалить несколько рецептов из избранного
+        """
+        return related_field_batch(request, 'favourites')
+
+    @action(detail=False,
+            methods=['POST', 'DELETE'],
+            url_path='shopping_cart',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_batch(self, request):
+        """
+        Добавить/удалить несколько рецептов из списка покупок
+        """
+        return related_field_batch(request, 'shopping_cart')
+
+    @action(detail=False,
+            methods=['GET'],
+            permission_classes=(IsAuthenticated,),
+            content_negotiation_class=IgnoreFormatContentNegotiation)
     def download_shopping_cart(self, request):
         """
-        Скачать список покупок
+        Скачать список покупок в формате pdf, txt, csv или json
         """
-        shopping_cart = IngredientRecipe.objects.filter(
-            recipe__is_in_shopping_cart__id=request.user.id).values(
-                'ingredient__name', 'ingredient__measurement_unit').annotate(
-                    amount=Sum('amount'))
+        export_format = request.query_params.get('format', 'pdf')
+        if export_format != 'pdf' and (
+                export_format not in SHOPPING_CART_FORMATS):
+            raise ValidationError(
+                {'format': 'Допустимые значения: pdf, txt, csv, json.'})
+
+        shopping_cart = ShoppingListItem.objects.filter(
+            user=request.user).values(
+                'ingredient', 'ingredient__name',
+                'ingredient__measurement_unit', 'amount').order_by(
+                    'ingredient__name')
+        filename = f'shopping_cart.{export_format}'
 
-        buffer = io.BytesIO()
-        create_pdf(buffer, shopping_cart)
-        buffer.seek(0)
+        if export_format == 'pdf':
+            # PDF кэшируется по хэшу содержимого списка покупок
+            etag = quote_etag(get_shopping_cart_digest(
+                request.user.id, shopping_cart))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                content = get_shopping_cart_pdf(etag.strip('"'),
+                                                shopping_cart)
+                response = FileResponse(io.BytesIO(content),
+                                        as_attachment=True,
+                                        filename=filename)
+            response['ETag'] = etag
+            return response
 
-        return FileResponse(buffer, as_attachment=True,
-                            filename='shopping_cart.pdf')
+        content_type, render = SHOPPING_CART_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            render(shopping_cart.iterator()), content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"')
+        return response
@@ -19,13 +19,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
     'djoser',
-    'api',
+    'api.apps.ApiConfig',
     'users',
-    'recipes',
+    'recipes.apps.RecipesConfig',
 ]
 
 MIDDLEWARE = [
@@ -104,13 +105,26 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Общий кэш всех процессов (web, image_worker, команды): версии индексов
+# и справочников, снимки рецептов, Membership пользователей, токены
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.memcached.MemcachedCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION',
+                                   default='127.0.0.1:11211'),
+    }
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
@@ -119,6 +133,17 @@ REST_FRAMEWORK = {
     'SEARCH_PARAM': 'name',
 }
 
+# Обработка изображений рецептов в процессе запроса, а не в
+# process_image_jobs (для тестов)
+IMAGE_JOBS_EAGER = os.environ.get(
+    'IMAGE_JOBS_EAGER', default='').lower() in ('1', 'true', 'yes')
+
+# Индекс похожих рецептов, см. команду build_similar_recipes
+SIMILAR_RECIPES_INDEX = os.environ.get(
+    'SIMILAR_RECIPES_INDEX',
+    default=os.path.join(BASE_DIR, 'indexes', 'similar_recipes.idx')
+)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'SERIALIZERS': {
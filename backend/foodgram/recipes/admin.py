@@ -10,15 +10,11 @@ class RecipeIngredientInline(admin.TabularInline):
 
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (RecipeIngredientInline,)
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
     list_filter = ('name', 'author', 'tags')
     fields = ('name', 'text', 'cooking_time', 'tags',
-              'image', 'author', 'favorites_count')
-    readonly_fields = ('favorites_count',)
-
-    def favorites_count(self, obj):
-        return obj.is_favorited.count()
-    favorites_count.short_description = 'Число добавлений в избранное'
+              'image', 'author', 'favorites_count', 'in_carts_count')
+    readonly_fields = ('favorites_count', 'in_carts_count')
 
 
 class TagAdmin(admin.ModelAdmin):
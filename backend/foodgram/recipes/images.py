@@ -0,0 +1,120 @@
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .storage import image_storage
+
+# Варианты изображения рецепта: наибольшая сторона в пикселях
+IMAGE_VARIANTS = {
+    'thumbnail': 160,
+    'card': 480,
+    'full': 1280,
+}
+# Наибольшая сторона исходного изображения после обработки
+IMAGE_MAX_SIZE = 2560
+IMAGE_VARIANTS_DIR = 'recipes/variants'
+IMAGE_VARIANT_FORMAT = 'webp'
+IMAGE_VARIANT_QUALITY = 80
+
+
+# Сигнатуры допустимых форматов: тип определяется по заголовку файла,
+# без разбора изображения Pillow
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+# Параметры сохранения обработанного исходного изображения
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 90},
+}
+# Ориентация в EXIF
+ORIENTATION_TAG = 0x0112
+
+
+def sniff_image_type(content):
+    for signature, extension in IMAGE_SIGNATURES:
+        if content.startswith(signature):
+            return extension
+    return None
+
+
+def variant_name(image_name, variant):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'{IMAGE_VARIANTS_DIR}/{stem}_{variant}.{IMAGE_VARIANT_FORMAT}'
+
+
+def variant_names(image_name):
+    return {variant: variant_name(image_name, variant)
+            for variant in IMAGE_VARIANTS}
+
+
+def render_variants(image):
+    """
+    Уменьшенные копии изображения в формате WebP: {variant: bytes}
+    """
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    variants = {}
+    for variant, size in IMAGE_VARIANTS.items():
+        copy = image.copy()
+        copy.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        copy.save(buffer, IMAGE_VARIANT_FORMAT.upper(),
+                  quality=IMAGE_VARIANT_QUALITY, method=4)
+        variants[variant] = buffer.getvalue()
+    return variants
+
+
+def save_variants(image_name, image, storage=default_storage):
+    for variant, content in render_variants(image).items():
+        name = variant_name(image_name, variant)
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(content))
+
+
+def generate_variants(image_name, storage=default_storage):
+    """
+    Создать варианты изображения image_name в хранилище
+    """
+    with storage.open(image_name) as file:
+        with Image.open(file) as image:
+            save_variants(image_name, image, storage)
+
+
+def process_image(image_name, storage=default_storage):
+    """
+    Проверить изображение, повернуть по EXIF, уменьшить до IMAGE_MAX_SIZE
+    и создать варианты в storage. Возвращает имя файла исходного
+    изображения: если оно изменилось, сохраняется новый файл, прежний
+    может использоваться другими рецептами и остаётся на месте.
+    """
+    with image_storage.open(image_name) as file:
+        content = file.read()
+    with Image.open(io.BytesIO(content)) as image:
+        image.verify()
+
+    image = Image.open(io.BytesIO(content))
+    image_format = image.format
+    rewrite = image.getexif().get(ORIENTATION_TAG, 1) != 1
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > IMAGE_MAX_SIZE:
+        image.thumbnail((IMAGE_MAX_SIZE, IMAGE_MAX_SIZE), Image.LANCZOS)
+        rewrite = True
+    if rewrite:
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, **SAVE_OPTIONS.get(image_format, {}))
+        image_name = image_storage.save(image_name,
+                                        ContentFile(buffer.getvalue()))
+    # Имя файла определяется содержимым, поэтому готовые варианты
+    # того же файла не создаются заново
+    if not all(storage.exists(name)
+               for name in variant_names(image_name).values()):
+        save_variants(image_name, image, storage)
+    return image_name
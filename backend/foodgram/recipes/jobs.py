@@ -0,0 +1,127 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .images import process_image
+from .models import (FeedBackfillJob, FeedItem, ImageJob, Recipe,
+                     StoredFile, Subscription)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_JOB_MAX_ATTEMPTS = 3
+
+
+def enqueue_image_job(recipe):
+    """
+    Поставить изображение рецепта в очередь обработки.
+    С IMAGE_JOBS_EAGER (в тестах) задача выполняется в том же процессе
+    после фиксации транзакции.
+    """
+    job = ImageJob.objects.create(recipe=recipe, image=recipe.image.name)
+    if getattr(settings, 'IMAGE_JOBS_EAGER', False):
+        transaction.on_commit(lambda: run_image_job(job.pk))
+    return job
+
+
+def enqueue_image_jobs(recipes):
+    """
+    Поставить в очередь изображения рецептов, созданных пакетом,
+    одной вставкой. Id задач нужны для IMAGE_JOBS_EAGER: пакетная
+    вставка возвращает их не на всех СУБД
+    """
+    jobs = ImageJob.objects.bulk_create([
+        ImageJob(recipe=recipe, image=recipe.image.name)
+        for recipe in recipes if recipe.image
+    ])
+    if getattr(settings, 'IMAGE_JOBS_EAGER', False):
+        job_ids = [job.pk for job in jobs]
+        transaction.on_commit(lambda: [
+            run_image_job(job_pk) for job_pk in job_ids])
+    return jobs
+
+
+def process_image_job(job):
+    current_image = Recipe.objects.filter(pk=job.recipe_id).values_list(
+        'image', flat=True).first()
+    if current_image != job.image:
+        # Изображение рецепта уже заменено новым
+        job.delete()
+        return
+    try:
+        image_name = process_image(job.image)
+    except Exception as error:
+        logger.warning('Image job %s failed: %s', job.pk, error)
+        job.attempts += 1
+        job.error = str(error)
+        if job.attempts < IMAGE_JOB_MAX_ATTEMPTS:
+            job.save(update_fields=['attempts', 'error'])
+            return
+        job.delete()
+        Recipe.objects.filter(pk=job.recipe_id, image=job.image).update(
+            image_status=Recipe.IMAGE_FAILED, modified=timezone.now())
+        return
+    job.delete()
+    updated = Recipe.objects.filter(pk=job.recipe_id, image=job.image).update(
+        image=image_name, image_status=Recipe.IMAGE_READY,
+        modified=timezone.now())
+    if image_name != job.image:
+        # Обработанное изображение сохранено как новый файл:
+        # тот же исходный файл при повторной загрузке заменяется им
+        StoredFile.objects.filter(name=job.image).update(
+            processed_name=image_name)
+    if updated and image_name != job.image:
+        StoredFile.objects.acquire(image_name)
+        StoredFile.objects.release(job.image)
+
+
+def run_image_job(job_pk):
+    with transaction.atomic():
+        job = ImageJob.objects.select_for_update(skip_locked=True).filter(
+            pk=job_pk).first()
+        if job is not None:
+            process_image_job(job)
+
+
+def enqueue_feed_backfill(author_id):
+    """
+    Поставить в очередь заполнение лент подписчиков автора.
+    С IMAGE_JOBS_EAGER задача выполняется после фиксации транзакции
+    """
+    FeedBackfillJob.objects.create(author_id=author_id)
+    if getattr(settings, 'IMAGE_JOBS_EAGER', False):
+        transaction.on_commit(run_feed_jobs)
+
+
+def run_feed_jobs(limit=10):
+    """
+    Выполнить до limit задач заполнения лент. Если подписчиков автора
+    снова больше FANOUT_MAX, его рецепты добавляются в ленты при чтении
+    и задача только удаляется
+    """
+    with transaction.atomic():
+        jobs = list(FeedBackfillJob.objects.select_for_update(
+            skip_locked=True).order_by('id')[:limit])
+        for job in jobs:
+            if FeedItem.objects.is_fanned_out(job.author_id):
+                FeedItem.objects.backfill(
+                    Subscription.objects.filter(
+                        author_id=job.author_id).values_list(
+                            'user_id', flat=True).iterator(),
+                    job.author_id)
+            job.delete()
+    return len(jobs)
+
+
+def run_image_jobs(limit=10):
+    """
+    Обработать до limit задач из очереди. Задачи, заблокированные
+    другими обработчиками, пропускаются.
+    """
+    with transaction.atomic():
+        jobs = list(ImageJob.objects.select_for_update(
+            skip_locked=True).order_by('id')[:limit])
+        for job in jobs:
+            process_image_job(job)
+    return len(jobs)
@@ -0,0 +1,147 @@
+import random
+import statistics
+import time
+import uuid
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from users.models import User
+
+# Слова для синтетических названий и текстов
+WORDS = (
+    'курица', 'говядина', 'свинина', 'рыба', 'лосось', 'треска', 'креветки',
+    'картофель', 'морковь', 'лук', 'чеснок', 'капуста', 'свёкла', 'томаты',
+    'огурцы', 'перец', 'баклажаны', 'кабачки', 'грибы', 'шампиньоны',
+    'рис', 'гречка', 'макароны', 'овсянка', 'мука', 'сахар', 'соль',
+    'масло', 'сливки', 'сметана', 'творог', 'сыр', 'яйца', 'молоко',
+    'яблоки', 'груши', 'вишня', 'клубника', 'малина', 'лимон', 'апельсин',
+    'запечённый', 'жареный', 'тушёный', 'варёный', 'копчёный', 'острый',
+    'сладкий', 'домашний', 'быстрый', 'праздничный', 'постный', 'летний',
+    'суп', 'салат', 'пирог', 'рагу', 'соус', 'каша', 'запеканка', 'блины',
+)
+BATCH_SIZE = 5000
+
+
+class BenchmarkCommand(BaseCommand):
+    """
+    Замер на синтетических данных. Данные создаются в транзакции,
+    которая откатывается после замера, поэтому БД не меняется
+    """
+    default_repeat = 20
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=self.default_repeat,
+            help='Number of timed runs of each case',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for synthetic data',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        with transaction.atomic():
+            self.benchmark(**options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, **options):
+        raise NotImplementedError
+
+    def measure(self, label, function, repeat, operations=1):
+        """
+        Время одной операции: медиана и 95-й процентиль по repeat
+        запускам function, выполняющей operations операций
+        """
+        function()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000 / operations)
+        timings.sort()
+        median = statistics.median(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(f'{label}: median {median:.3f} ms, '
+                          f'p95 {p95:.3f} ms')
+        return median
+
+    def phrase(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def create_author(self):
+        suffix = uuid.uuid4().hex[:12]
+        return User.objects.create_user(
+            email=f'benchmark-{suffix}@example.com',
+            username=f'benchmark-{suffix}',
+            first_name='Benchmark',
+            last_name='Benchmark',
+        )
+
+    def create_ingredients(self, count):
+        prefix = uuid.uuid4().hex[:6]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'{self.phrase(2)} {prefix}{number}',
+                       measurement_unit='г')
+            for number in range(count)
+        )
+        # Не все СУБД возвращают id созданных строк
+        return list(Ingredient.objects.filter(name__contains=prefix))
+
+    def create_tags(self, count):
+        prefix = uuid.uuid4().hex[:6]
+        Tag.objects.bulk_create(
+            Tag(name=f'{prefix} {number}', slug=f'{prefix}-{number}',
+                color='#FF0000')
+            for number in range(count)
+        )
+        return list(Tag.objects.filter(slug__startswith=prefix))
+
+    def create_recipes(self, count, author, ingredients=(), tags=(),
+                       ingredients_per_recipe=5, text_words=30):
+        """
+        Рецепты автора author пакетами по BATCH_SIZE. Для каждого
+        рецепта выбираются случайные ингредиенты и один тег
+        """
+        prefix = uuid.uuid4().hex[:6]
+        recipes = (
+            Recipe(name=f'{self.phrase(3)} {prefix}{number}',
+                   text=self.phrase(text_words),
+                   cooking_time=self.random.randint(5, 120),
+                   image='recipes/benchmark.png',
+                   image_status=Recipe.IMAGE_READY,
+                   author=author)
+            for number in range(count)
+        )
+        created = 0
+        while True:
+            batch = list(islice(recipes, BATCH_SIZE))
+            if not batch:
+                break
+            if not Recipe.objects.bulk_create(batch)[0].pk:
+                batch = list(Recipe.objects.order_by('-id')[:len(batch)])
+            if ingredients:
+                IngredientRecipe.objects.bulk_create([
+                    IngredientRecipe(recipe_id=recipe.pk,
+                                     ingredient_id=ingredient.pk,
+                                     amount=self.random.randint(1, 500))
+                    for recipe in batch
+                    for ingredient in self.random.sample(
+                        ingredients, ingredients_per_recipe)
+                ])
+            if tags:
+                Recipe.tags.through.objects.bulk_create([
+                    Recipe.tags.through(recipe_id=recipe.pk,
+                                        tag_id=self.random.choice(tags).pk)
+                    for recipe in batch
+                ])
+            created += len(batch)
+            self.stdout.write(f'{created} recipes created')
+        return created
@@ -0,0 +1,61 @@
+from api.search import fuzzy_search, ingredient_index
+from recipes.models import Ingredient
+from ._benchmark import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = ('Measure ingredient search latency: prefix index and fuzzy '
+            'search against the LIKE queries of the old search filter')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=20000,
+            help='Number of synthetic ingredients added to existing ones',
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=50,
+            help='Number of search queries per run',
+        )
+
+    def make_queries(self, names, count):
+        """
+        Начала названий разной длины и названия с опечаткой
+        """
+        queries = []
+        for name in self.random.sample(names, count):
+            if len(queries) % 2:
+                position = self.random.randrange(len(name))
+                queries.append(name[:position] + name[position + 1:])
+            else:
+                queries.append(name[:self.random.randint(2, 6)])
+        return queries
+
+    def benchmark(self, **options):
+        self.create_ingredients(options['ingredients'])
+        ingredient_index.invalidate()
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        self.stdout.write(f'{len(names)} ingredients')
+        queries = self.make_queries(names, min(options['queries'],
+                                               len(names)))
+        repeat = options['repeat']
+
+        def run(search):
+            return lambda: [search(query) for query in queries]
+
+        self.measure('LIKE name ILIKE query%', run(
+            lambda query: list(Ingredient.objects.filter(
+                name__istartswith=query)[:20])
+        ), repeat, len(queries))
+        self.measure('LIKE name ILIKE %query%', run(
+            lambda query: list(Ingredient.objects.filter(
+                name__icontains=query)[:20])
+        ), repeat, len(queries))
+        self.measure('prefix index', run(ingredient_index.prefix),
+                     repeat, len(queries))
+        self.measure('fuzzy search', run(fuzzy_search),
+                     repeat, len(queries))
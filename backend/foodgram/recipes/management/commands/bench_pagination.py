@@ -0,0 +1,70 @@
+from urllib.parse import parse_qs, urlparse
+
+from django.test import RequestFactory
+from rest_framework.pagination import Cursor
+from rest_framework.request import Request
+
+from api.conditional import validator_rows
+from api.pagination import CustomPagination, IdCursorPagination
+from recipes.models import Recipe
+from ._benchmark import BenchmarkCommand
+
+PAGE_SIZE = 10
+
+
+class Command(BenchmarkCommand):
+    help = ('Measure the time to fetch a page of the recipe list at growing '
+            'depth with page number (OFFSET) and cursor pagination')
+    default_repeat = 10
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=1000000,
+            help='Number of synthetic recipes',
+        )
+        parser.add_argument(
+            '--depths',
+            default='1,100,1000,10000,50000',
+            help='Comma-separated page numbers to fetch',
+        )
+
+    def fetch(self, params):
+        request = Request(RequestFactory().get('/api/recipes/', params))
+        paginator = CustomPagination()
+        return paginator.paginate_queryset(
+            validator_rows(Recipe.objects.all()), request)
+
+    def cursor_params(self, page):
+        """
+        Параметры запроса страницы page по курсору: позиция курсора -
+        id последнего рецепта предыдущей страницы
+        """
+        params = {'limit': PAGE_SIZE, 'cursor': ''}
+        if page > 1:
+            position = Recipe.objects.order_by('-id').values_list(
+                'id', flat=True)[(page - 1) * PAGE_SIZE - 1]
+            paginator = IdCursorPagination()
+            paginator.base_url = '/api/recipes/'
+            url = paginator.encode_cursor(Cursor(
+                offset=0, reverse=False, position=str(position)))
+            params['cursor'] = parse_qs(urlparse(url).query)['cursor'][0]
+        return params
+
+    def benchmark(self, **options):
+        author = self.create_author()
+        self.create_recipes(options['recipes'], author, text_words=5)
+        total = Recipe.objects.count()
+        for page in (int(depth) for depth in options['depths'].split(',')):
+            if (page - 1) * PAGE_SIZE >= total:
+                self.stdout.write(f'page {page}: beyond {total} recipes')
+                continue
+            self.measure(
+                f'page {page}, page number',
+                lambda: self.fetch({'limit': PAGE_SIZE, 'page': page}),
+                options['repeat'])
+            params = self.cursor_params(page)
+            self.measure(f'page {page}, cursor',
+                         lambda: self.fetch(params), options['repeat'])
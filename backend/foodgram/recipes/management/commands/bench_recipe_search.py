@@ -0,0 +1,67 @@
+from django.db import connection
+
+from api.search import RECIPE_SEARCH_VECTOR, recipe_index, search_recipes
+from recipes.models import Recipe
+from ._benchmark import BenchmarkCommand
+
+PAGE_SIZE = 10
+
+
+class Command(BenchmarkCommand):
+    help = ('Measure recipe search: in-memory index build, incremental '
+            'update and query latency')
+    default_repeat = 5
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=500000,
+            help='Number of synthetic recipes',
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=20,
+            help='Number of search queries per run',
+        )
+        parser.add_argument(
+            '--changes',
+            type=int,
+            default=10,
+            help='Number of recipes changed between index updates',
+        )
+
+    def benchmark(self, **options):
+        author = self.create_author()
+        self.create_recipes(options['recipes'], author)
+        if connection.vendor == 'postgresql':
+            Recipe.objects.filter(author=author).update(
+                search_vector=RECIPE_SEARCH_VECTOR)
+        self.stdout.write(f'{Recipe.objects.count()} recipes')
+        repeat = options['repeat']
+
+        # Построение индекса занимает секунды, оно выполняется один раз
+        self.measure('index rebuild', recipe_index._rebuild, 1)
+        recipe_index.invalidate()
+        recipe_index.sync()
+        recipe_ids = list(Recipe.objects.filter(
+            author=author).values_list('id', flat=True))
+        changed = self.random.sample(recipe_ids, options['changes'])
+        for pk in changed:
+            Recipe.objects.filter(pk=pk).update(
+                text=f'{self.phrase(30)} {pk}')
+        self.measure(f'index update, {len(changed)} recipes',
+                     lambda: recipe_index._update(changed), repeat)
+
+        queries = [self.phrase(1 + number % 2)
+                   for number in range(options['queries'])]
+        self.measure('index search, all matches', lambda: [
+            recipe_index.search(query) for query in queries
+        ], repeat, len(queries))
+        self.measure(f'search_recipes, first {PAGE_SIZE}', lambda: [
+            list(search_recipes(Recipe.objects.all(), query).values_list(
+                'id', flat=True)[:PAGE_SIZE])
+            for query in queries
+        ], repeat, len(queries))
@@ -0,0 +1,113 @@
+import heapq
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from django.test import override_settings
+
+from api.similar import (SIMILAR_RECIPES_LIMIT, SimilarRecipesIndex,
+                         build_snapshot, recipe_features)
+from ._benchmark import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = ('Measure recall and latency of the MinHash/LSH similar recipes '
+            'index against exact Jaccard similarity')
+    default_repeat = 5
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=100000,
+            help='Number of synthetic recipes',
+        )
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=300,
+            help='Number of synthetic ingredients',
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=100,
+            help='Number of recipes whose similar recipes are compared',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=SIMILAR_RECIPES_LIMIT,
+            help='Number of similar recipes per recipe (K in recall@K)',
+        )
+
+    def exact_similar(self, features, postings, recipe_id):
+        """
+        Точное сходство по Жаккару со всеми рецептами, у которых
+        есть общий признак: {id: оценка}
+        """
+        own = features[recipe_id]
+        candidates = set().union(*(postings[feature] for feature in own))
+        candidates.discard(recipe_id)
+        return {
+            candidate: len(own & features[candidate])
+            / len(own | features[candidate])
+            for candidate in candidates
+        }
+
+    def recall(self, found, exact, limit):
+        """
+        Доля найденных рецептов из точных limit лучших; рецепты
+        с той же оценкой, что у последнего из них, тоже считаются верными
+        """
+        if not exact:
+            return 1.0
+        scores = sorted(exact.values(), reverse=True)
+        threshold = scores[min(limit, len(scores)) - 1]
+        relevant = {pk for pk, score in exact.items() if score >= threshold}
+        return len(relevant & {pk for pk, _ in found}) / min(
+            limit, len(scores))
+
+    def benchmark(self, **options):
+        author = self.create_author()
+        ingredients = self.create_ingredients(options['ingredients'])
+        tags = self.create_tags(10)
+        self.create_recipes(options['recipes'], author, ingredients, tags,
+                            ingredients_per_recipe=6, text_words=5)
+        features = recipe_features()
+        postings = defaultdict(set)
+        for recipe_id, own in features.items():
+            for feature in own:
+                postings[feature].add(recipe_id)
+        samples = self.random.sample(sorted(features), min(
+            options['samples'], len(features)))
+        limit = options['limit']
+        repeat = options['repeat']
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                SIMILAR_RECIPES_INDEX=os.path.join(directory, 'similar.idx')):
+            start = time.perf_counter()
+            count = build_snapshot()
+            self.stdout.write(f'index of {count} recipes built in '
+                              f'{time.perf_counter() - start:.1f} s')
+            index = SimilarRecipesIndex()
+            index.sync()
+            recall = [
+                self.recall(index.similar(recipe_id, limit),
+                            self.exact_similar(features, postings,
+                                               recipe_id), limit)
+                for recipe_id in samples
+            ]
+            self.stdout.write(
+                f'recall@{limit}: {sum(recall) / len(recall):.3f}')
+            self.measure('index', lambda: [
+                index.similar(recipe_id, limit) for recipe_id in samples
+            ], repeat, len(samples))
+        self.measure('exact Jaccard', lambda: [
+            heapq.nlargest(limit, self.exact_similar(
+                features, postings, recipe_id).items(),
+                key=lambda item: (item[1], item[0]))
+            for recipe_id in samples
+        ], repeat, len(samples))
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.core.management.base import CommandError
+from django.test import Client, override_settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api.authentication import CachedTokenAuthentication
+from ._benchmark import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = ('Measure authenticated request throughput with and without '
+            'the token cache of CachedTokenAuthentication')
+    default_repeat = 5
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Number of requests per run',
+        )
+        parser.add_argument(
+            '--url',
+            default='/api/users/me/',
+            help='URL requested with the token',
+        )
+
+    def benchmark(self, **options):
+        token = Token.objects.create(user=self.create_author())
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        url = options['url']
+        requests = options['requests']
+
+        def run():
+            for _ in range(requests):
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(
+                        f'{url} returned {response.status_code}')
+
+        with override_settings(ALLOWED_HOSTS=['*']):
+            cached = self.measure('token cache', run, options['repeat'],
+                                  requests)
+            with mock.patch.object(
+                    CachedTokenAuthentication, 'authenticate_credentials',
+                    TokenAuthentication.authenticate_credentials):
+                uncached = self.measure('TokenAuthentication', run,
+                                        options['repeat'], requests)
+        self.stdout.write(f'{1000 / cached:.0f} req/s with token cache, '
+                          f'{1000 / uncached:.0f} req/s without')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.similar import build_snapshot, index_path
+
+
+class Command(BaseCommand):
+    help = ('Build the MinHash/LSH index of similar recipes '
+            'and save it to SIMILAR_RECIPES_INDEX')
+
+    def handle(self, *args, **options):
+        count = build_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} recipes indexed, saved to {index_path()}.'))
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.images import variant_names
+from recipes.models import Recipe, StoredFile
+from recipes.storage import image_storage
+
+IMAGES_DIR = Recipe._meta.get_field('image').upload_to.rstrip('/')
+
+
+class Command(BaseCommand):
+    help = ('Delete recipe images and their variants '
+            'that are not referenced by any recipe')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help=('Keep files modified less than this many seconds ago: '
+                  'they may belong to recipes that are being saved'),
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list the files that would be deleted',
+        )
+
+    def is_orphan(self, name, references, cutoff):
+        if references.get(name, 0) > 0:
+            return False
+        if image_storage.get_modified_time(name) > cutoff:
+            return False
+        # Защита от расхождения счётчиков с рецептами
+        return not Recipe.objects.filter(image=name).exists()
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        references = dict(StoredFile.objects.values_list('name',
+                                                         'references'))
+        _, files = image_storage.listdir(IMAGES_DIR)
+        orphans = [
+            name for name in (f'{IMAGES_DIR}/{file}' for file in files)
+            if self.is_orphan(name, references, cutoff)
+        ]
+
+        for name in orphans:
+            self.stdout.write(name)
+            if options['dry_run']:
+                continue
+            image_storage.delete(name)
+            for variant in variant_names(name).values():
+                default_storage.delete(variant)
+        if not options['dry_run']:
+            existing = {f'{IMAGES_DIR}/{file}' for file in files}
+            missing = [name for name, count in references.items()
+                       if count <= 0 and name not in existing]
+            # Записи заменённых обработкой файлов нужны, пока
+            # исходный файл могут загрузить снова
+            StoredFile.objects.filter(
+                name__in=orphans + missing, references=0,
+                processed_name='').delete()
+
+        action = 'found' if options['dry_run'] else 'deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(orphans)} orphaned images {action}.'))
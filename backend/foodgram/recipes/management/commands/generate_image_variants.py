@@ -0,0 +1,38 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from recipes.images import generate_variants, variant_names
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Generate thumbnail, card and full WebP variants '
+            'for recipe images')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate variants that already exist',
+        )
+
+    def handle(self, *args, **options):
+        generated = skipped = failed = 0
+        images = Recipe.objects.exclude(image='').values_list(
+            'image', flat=True).distinct().iterator()
+        for image_name in images:
+            if not options['force'] and all(
+                    default_storage.exists(name)
+                    for name in variant_names(image_name).values()):
+                skipped += 1
+                continue
+            try:
+                generate_variants(image_name)
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f'{image_name}: {e}')
+                continue
+            generated += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'{generated} images processed, {skipped} skipped, '
+            f'{failed} failed.'))
@@ -1,27 +1,198 @@
 import csv
+import json
+import os
+import re
+from itertools import islice
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from api.search import bump_ingredients_version
 from recipes.models import Ingredient
 
+DEFAULT_FILE = os.path.join(settings.BASE_DIR, 'recipes/data/ingredients.csv')
+JSON_CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s*')
+# Состояния разбора массива верхнего уровня: start - ожидается '[',
+# first - элемент или ']', value - элемент, next - ',' или ']',
+# end - только пробелы до конца файла
+JSON_TRANSITIONS = {
+    ('start', '['): 'first',
+    ('first', ']'): 'end',
+    ('next', ','): 'value',
+    ('next', ']'): 'end',
+}
+JSON_ERRORS = {
+    'start': 'Expecting top-level array',
+    'next': "Expecting ',' delimiter",
+    'end': 'Extra data',
+}
+
+
+def decode_json_item(decoder, buffer, position, eof):
+    """
+    Элемент массива с позиции position и позиция после него;
+    None, если элемент может продолжаться в следующей части файла
+    """
+    try:
+        item, end = decoder.raw_decode(buffer, position)
+    except json.JSONDecodeError:
+        if eof:
+            raise
+        return None
+    # Без разделителя после элемента элемент (например, число)
+    # может быть прочитан не полностью
+    delimiter = WHITESPACE.match(buffer, end).end()
+    if not eof and buffer[delimiter:delimiter + 1] not in (',', ']'):
+        return None
+    return item, end
+
+
+def iter_json_array(file, chunk_size=JSON_CHUNK_SIZE):
+    """
+    Элементы массива верхнего уровня по одному: файл читается частями,
+    в памяти только непрочитанный остаток текущей части
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    state = 'start'
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        char = buffer[position:position + 1]
+        if char and state in ('first', 'value') and (
+                state, char) not in JSON_TRANSITIONS:
+            decoded = decode_json_item(decoder, buffer, position, eof)
+            if decoded is not None:
+                item, position = decoded
+                state = 'next'
+                yield item
+                continue
+            # Нужна следующая часть файла
+            char = ''
+        if not char:
+            if eof:
+                break
+            chunk = file.read(chunk_size)
+            buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+            continue
+        if (state, char) not in JSON_TRANSITIONS:
+            raise json.JSONDecodeError(JSON_ERRORS[state], buffer, position)
+        state = JSON_TRANSITIONS[state, char]
+        position += 1
+    if state != 'end':
+        raise json.JSONDecodeError('Unterminated array', buffer, position)
+
+
+def read_json(file):
+    for item in iter_json_array(file):
+        if isinstance(item, dict):
+            yield item.get('name'), item.get('measurement_unit')
+        else:
+            yield item
+
+
+READERS = {
+    'csv': csv.reader,
+    'json': read_json,
+}
+
 
 class Command(BaseCommand):
-    help = ('Import ingredients data from CSV file to DB')
+    help = ('Import ingredients data from CSV or JSON file to DB')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=DEFAULT_FILE,
+            help='Path to the data file',
+        )
+        parser.add_argument(
+            '--format',
+            choices=READERS,
+            help='Data file format, by default taken from the file extension',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of ingredients inserted per query',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Parse and validate the file without writing to DB',
+        )
+
+    def parse(self, rows):
+        """
+        Корректные ингредиенты без повторов;
+        некорректные строки пропускаются и учитываются в self.invalid
+        """
+        seen = set()
+        for line, row in enumerate(rows, start=1):
+            try:
+                name, unit = (value.strip() for value in row)
+            except (TypeError, ValueError, AttributeError):
+                self.invalid += 1
+                self.stderr.write(f'Invalid row {line}: {row!r}')
+                continue
+            if not name or not unit or len(name) > 256 or len(unit) > 256:
+                self.invalid += 1
+                self.stderr.write(f'Invalid row {line}: {row!r}')
+                continue
+            if name in seen:
+                self.skipped += 1
+                continue
+            seen.add(name)
+            yield Ingredient(name=name, measurement_unit=unit)
+
+    def import_batches(self, ingredients, batch_size, dry_run):
+        while True:
+            batch = list(islice(ingredients, batch_size))
+            if not batch:
+                break
+            existing = set(Ingredient.objects.filter(
+                name__in=[ingredient.name for ingredient in batch]
+            ).values_list('name', flat=True))
+            batch = [ingredient for ingredient in batch
+                     if ingredient.name not in existing]
+            self.skipped += len(existing)
+            self.inserted += len(batch)
+            if not dry_run:
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            self.stdout.write(
+                f'{self.inserted + self.skipped + self.invalid} '
+                f'rows processed')
 
     def handle(self, *args, **options):
-        file_path = 'recipes/data/ingredients.csv'
+        file_path = options['file']
+        file_format = options['format'] or os.path.splitext(
+            file_path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Unknown data file format: {file_format}')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('Batch size must be positive')
 
+        self.inserted = self.skipped = self.invalid = 0
         try:
             with open(file_path, encoding='utf-8') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    name, unit = row
-                    Ingredient.objects.get_or_create(
-                        name=name, measurement_unit=unit)
+                with transaction.atomic():
+                    self.import_batches(
+                        self.parse(READERS[file_format](f)),
+                        batch_size, options['dry_run'])
         except FileNotFoundError:
             raise CommandError(f'{file_path} file does not exist')
-        except Exception as e:
+        except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
             raise CommandError(f'Data import failed: {e}')
 
+        if self.inserted and not options['dry_run']:
+            # bulk_create не отправляет post_save, индекс поиска
+            # ингредиентов нужно сбросить явно
+            bump_ingredients_version()
+
+        prefix = 'Dry run: ' if options['dry_run'] else ''
         self.stdout.write(self.style.SUCCESS(
-            'Ingredients successfully imported.'))
+            f'{prefix}{self.inserted} ingredients imported, '
+            f'{self.skipped} skipped, {self.invalid} invalid.'))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.jobs import run_feed_jobs, run_image_jobs
+
+
+class Command(BaseCommand):
+    help = ('Process queued recipe images: verify, normalize orientation, '
+            'cap size and generate variants; fill subscription feeds '
+            'of authors that lost followers')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the queued jobs and exit',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help='Number of jobs taken from the queue at a time',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the queue is empty',
+        )
+
+    def handle(self, *args, **options):
+        processed = feeds = 0
+        while True:
+            count = run_image_jobs(options['batch_size'])
+            feed_count = run_feed_jobs(options['batch_size'])
+            processed += count
+            feeds += feed_count
+            if count or feed_count:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{processed} image jobs processed, {feeds} feeds filled.'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Rebuild users shopping lists from their shopping carts '
+            'or check them against the carts')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only compare shopping lists with shopping carts',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            ShoppingListItem.objects.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                'Shopping lists successfully rebuilt.'))
+            return
+
+        expected = {
+            (row['user_id'], row['ingredient_id']): row['total']
+            for row in ShoppingListItem.objects.live().iterator()
+        }
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount').iterator()
+        }
+        mismatches = [
+            (key, stored.get(key), expected.get(key))
+            for key in set(expected) | set(stored)
+            if stored.get(key) != expected.get(key)
+        ]
+        for (user_id, ingredient_id), amount, total in sorted(mismatches):
+            self.stdout.write(
+                f'user {user_id}, ingredient {ingredient_id}: '
+                f'stored {amount}, expected {total}')
+        if mismatches:
+            raise CommandError(
+                f'{len(mismatches)} shopping list items are out of date')
+        self.stdout.write(self.style.SUCCESS('Shopping lists are up to date.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Recipe, Subscription
+from users.models import User
+
+
+def count_links(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Recalculate denormalized favorites, shopping cart, '
+            'recipes and followers counters')
+
+    def reconcile(self, model, counter, actual):
+        drifted = model.objects.annotate(actual=actual).filter(
+            ~Q(**{counter: F('actual')})).values_list('pk', 'actual')
+        objs = [model(pk=pk, **{counter: value}) for pk, value in drifted]
+        model.objects.bulk_update(objs, [counter], batch_size=1000)
+        self.stdout.write(
+            f'{model._meta.model_name}.{counter}: {len(objs)} fixed')
+
+    def handle(self, *args, **options):
+        self.reconcile(Recipe, 'favorites_count',
+                       count_links(User.favourites.through, 'recipe'))
+        self.reconcile(Recipe, 'in_carts_count',
+                       count_links(User.shopping_cart.through, 'recipe'))
+        self.reconcile(User, 'recipes_count',
+                       count_links(Recipe, 'author'))
+        self.reconcile(User, 'followers_count',
+                       count_links(Subscription, 'author'))
+        self.stdout.write(self.style.SUCCESS(
+            'Counters successfully reconciled.'))
@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.models import F, Sum
+
+
+def populate_shopping_lists(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    rows = User.shopping_cart.through.objects.values(
+        'user_id',
+        ingredient_id=F('recipe__ingredients_amount__ingredient'),
+    ).annotate(
+        total=Sum('recipe__ingredients_amount__amount')
+    ).filter(ingredient_id__isnull=False).order_by()
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=row['user_id'],
+                          ingredient_id=row['ingredient_id'],
+                          amount=row['total'])
+         for row in rows.iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_auto_20261018_0336'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_shopping_lists,
+                             migrations.RunPython.noop),
+    ]
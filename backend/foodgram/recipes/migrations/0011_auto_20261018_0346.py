@@ -0,0 +1,45 @@
+# Generated by Django 3.0.5 on 2026-10-18 03:46
+
+from django.db import migrations, models
+from django.db.models import Count
+import recipes.storage
+
+
+def populate_stored_files(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    StoredFile = apps.get_model('recipes', 'StoredFile')
+    StoredFile.objects.bulk_create(
+        (StoredFile(name=row['image'], references=row['total'])
+         for row in Recipe.objects.exclude(image='').values(
+             'image').annotate(total=Count('pk')).order_by().iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_auto_20261018_0344'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True, verbose_name='Файл')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Число ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Изображение'),
+        ),
+        migrations.RunPython(populate_stored_files,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # Выражение совпадает с api.search.NORMALIZED_NAME
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_ingredient_normalized_name_trgm '
+        'ON recipes_ingredient USING gin '
+        "((replace(lower(name), 'ё', 'е')) gin_trgm_ops)"
+    )
+    schema_editor.execute('DROP INDEX IF EXISTS recipes_ingredient_name_trgm')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+        'ON recipes_ingredient USING gin (name gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'DROP INDEX IF EXISTS recipes_ingredient_normalized_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_ingredient_normalized_name_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='processed_name',
+            field=models.CharField(blank=True, help_text='Файл, сохранённый обработкой вместо этого', max_length=256, verbose_name='Обработанный файл'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.0.5 on 2026-10-18 04:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0016_storedfile_processed_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedBackfillJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_backfill_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Заполнение лент',
+                'verbose_name_plural': 'Заполнение лент',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -1,7 +1,12 @@
-from django.db import models
+from collections import Counter
+
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
 
 from users.models import User
 from .fields import ColorField
+from .storage import image_storage
 
 
 class Ingredient(models.Model):
@@ -49,6 +54,15 @@ class Tag(models.Model):
 
 
 class Recipe(models.Model):
+    IMAGE_PROCESSING = 'processing'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_PROCESSING, 'Обрабатывается'),
+        (IMAGE_READY, 'Готово'),
+        (IMAGE_FAILED, 'Ошибка обработки'),
+    )
+
     name = models.CharField(max_length=256, verbose_name='Название')
     text = models.TextField(verbose_name='Текст')
     cooking_time = models.PositiveSmallIntegerField(
@@ -66,14 +80,38 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/',
+        storage=image_storage,
         verbose_name='Изображение'
     )
+    image_status = models.CharField(
+        max_length=16,
+        choices=IMAGE_STATUSES,
+        default=IMAGE_PROCESSING,
+        editable=False,
+        verbose_name='Состояние изображения'
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
         verbose_name='Автор'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число добавлений в избранное'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число добавлений в список покупок'
+    )
+    modified = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    # Заполняется только на PostgreSQL, см. api.search
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         verbose_name = 'Рецепт'
@@ -141,3 +179,337 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f'{self.user.username} подписан на {self.author.username}'
+
+
+class FeedManager(models.Manager):
+    """
+    Лента рецептов авторов, на которых подписан пользователь.
+    Рецепты авторов, у которых не больше FANOUT_MAX подписчиков,
+    записываются в ленты подписчиков при создании; рецепты авторов
+    с большим числом подписчиков добавляются в ленту при чтении
+    """
+    FANOUT_MAX = 1000
+    BACKFILL_LIMIT = 100
+
+    def is_fanned_out(self, author_id):
+        followers_count = User.objects.filter(pk=author_id).values_list(
+            'followers_count', flat=True).first()
+        return (followers_count or 0) <= self.FANOUT_MAX
+
+    def fan_out(self, author_id, recipe_ids):
+        """
+        Добавить рецепты recipe_ids автора в ленты его подписчиков
+        """
+        self.bulk_create(
+            (self.model(user_id=user_id, recipe_id=recipe_id,
+                        author_id=author_id)
+             for user_id in Subscription.objects.filter(
+                 author_id=author_id).values_list(
+                     'user_id', flat=True).iterator()
+             for recipe_id in recipe_ids),
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+
+    def backfill(self, user_ids, author_id):
+        """
+        Добавить в ленты пользователей user_ids
+        последние BACKFILL_LIMIT рецептов автора
+        """
+        recipe_ids = list(Recipe.objects.filter(
+            author_id=author_id).order_by('-id').values_list(
+                'id', flat=True)[:self.BACKFILL_LIMIT])
+        self.bulk_create(
+            (self.model(user_id=user_id, recipe_id=recipe_id,
+                        author_id=author_id)
+             for user_id in user_ids for recipe_id in recipe_ids),
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+
+    def recipe_ids(self, user, before=None, limit=None):
+        """
+        Id рецептов ленты пользователя меньше before, по убыванию
+        """
+        fanned_out = self.filter(user=user)
+        # Рецепты авторов, ленты подписчиков которых ещё заполняются
+        # в фоне (FeedBackfillJob), тоже добавляются при чтении
+        pulled = Recipe.objects.filter(author_id__in=set(
+            Subscription.objects.filter(
+                models.Q(author__followers_count__gt=self.FANOUT_MAX)
+                | models.Q(author__feed_backfill_jobs__isnull=False),
+                user=user
+            ).values_list('author_id', flat=True)
+        ))
+        if before is not None:
+            fanned_out = fanned_out.filter(recipe_id__lt=before)
+            pulled = pulled.filter(id__lt=before)
+        recipe_ids = set(fanned_out.order_by('-recipe_id').values_list(
+            'recipe_id', flat=True)[:limit])
+        recipe_ids.update(pulled.order_by('-id').values_list(
+            'id', flat=True)[:limit])
+        return sorted(recipe_ids, reverse=True)[:limit]
+
+
+class FeedItem(models.Model):
+    """
+    Рецепт в ленте подписчика автора
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+
+    objects = FeedManager()
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='unique_feed_item'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'author'],
+                         name='feed_item_user_author'),
+        ]
+
+
+class FeedBackfillJob(models.Model):
+    """
+    Задача фонового добавления последних рецептов автора в ленты
+    подписчиков: число подписчиков снизилось до FeedManager.FANOUT_MAX
+    """
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_backfill_jobs',
+        verbose_name='Автор'
+    )
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Создана')
+
+    class Meta:
+        verbose_name = 'Заполнение лент'
+        verbose_name_plural = 'Заполнение лент'
+        ordering = ['id']
+
+    def __str__(self):
+        return str(self.author)
+
+
+class ImageJob(models.Model):
+    """
+    Задача фоновой обработки изображения рецепта
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='image_jobs',
+        verbose_name='Рецепт'
+    )
+    image = models.CharField(max_length=256, verbose_name='Изображение')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Создана')
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Число попыток'
+    )
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+
+    class Meta:
+        verbose_name = 'Обработка изображения'
+        verbose_name_plural = 'Обработка изображений'
+        ordering = ['id']
+
+    def __str__(self):
+        return self.image
+
+
+class StoredFileManager(models.Manager):
+
+    def acquire(self, name):
+        if self.filter(name=name).update(references=F('references') + 1):
+            return
+        _, created = self.get_or_create(name=name,
+                                        defaults={'references': 1})
+        if not created:
+            self.filter(name=name).update(references=F('references') + 1)
+
+    def acquire_many(self, names):
+        """
+        Добавить по ссылке на каждое имя names двумя запросами
+        """
+        counts = Counter(names)
+        if not counts:
+            return
+        self.bulk_create([self.model(name=name) for name in counts],
+                         ignore_conflicts=True)
+        self.filter(name__in=counts).update(references=F('references') + Case(
+            *[When(name=name, then=Value(count))
+              for name, count in counts.items()],
+            output_field=IntegerField(),
+        ))
+
+    def release(self, name):
+        self.filter(name=name, references__gt=0).update(
+            references=F('references') - 1)
+
+
+class StoredFile(models.Model):
+    """
+    Число рецептов, ссылающихся на файл изображения.
+    Файлы без ссылок удаляются командой collect_orphaned_images;
+    запись файла, который обработка заменила новым, остаётся
+    и ссылается на новый файл
+    """
+    name = models.CharField(max_length=256, unique=True,
+                            verbose_name='Файл')
+    references = models.PositiveIntegerField(default=0,
+                                             verbose_name='Число ссылок')
+    processed_name = models.CharField(
+        max_length=256,
+        blank=True,
+        verbose_name='Обработанный файл',
+        help_text='Файл, сохранённый обработкой вместо этого'
+    )
+
+    objects = StoredFileManager()
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
+
+    def __str__(self):
+        return self.name
+
+
+class ShoppingListManager(models.Manager):
+
+    @staticmethod
+    def recipe_amounts(recipe_ids):
+        """
+        Суммарное количество каждого ингредиента в рецептах recipe_ids
+        """
+        amounts = Counter()
+        for ingredient_id, amount in IngredientRecipe.objects.filter(
+                recipe_id__in=recipe_ids).values_list('ingredient_id',
+                                                      'amount'):
+            amounts[ingredient_id] += amount
+        return amounts
+
+    def apply(self, user_ids, amounts, sign=1):
+        """
+        Прибавить к спискам покупок пользователей user_ids количества
+        ингредиентов amounts ({ingredient_id: amount}), умноженные на sign
+        """
+        user_ids = list(user_ids)
+        amounts = {ingredient_id: amount * sign
+                   for ingredient_id, amount in amounts.items() if amount}
+        if not user_ids or not amounts:
+            return
+        with transaction.atomic():
+            # Изменения списков одного пользователя выполняются по очереди
+            list(User.objects.select_for_update().filter(
+                pk__in=user_ids).values_list('pk', flat=True))
+            items = self.filter(user_id__in=user_ids,
+                                ingredient_id__in=amounts)
+            existing = set(items.values_list('user_id', 'ingredient_id'))
+            items.update(amount=F('amount') + Case(
+                *[When(ingredient_id=ingredient_id, then=Value(amount))
+                  for ingredient_id, amount in amounts.items()],
+                output_field=IntegerField(),
+            ))
+            self.bulk_create([
+                self.model(user_id=user_id, ingredient_id=ingredient_id,
+                           amount=amount)
+                for user_id in user_ids
+                for ingredient_id, amount in amounts.items()
+                if amount > 0 and (user_id, ingredient_id) not in existing
+            ])
+            self.filter(user_id__in=user_ids, amount__lte=0).delete()
+
+    def update_recipe(self, recipe_id, old_amounts, new_amounts):
+        """
+        Учесть в списках покупок изменение ингредиентов рецепта
+        с old_amounts на new_amounts ({ingredient_id: amount})
+        """
+        delta = {
+            ingredient_id: (new_amounts.get(ingredient_id, 0)
+                            - old_amounts.get(ingredient_id, 0))
+            for ingredient_id in set(new_amounts) | set(old_amounts)
+        }
+        self.apply(
+            User.shopping_cart.through.objects.filter(
+                recipe_id=recipe_id).values_list('user_id', flat=True),
+            delta
+        )
+
+    @staticmethod
+    def live():
+        """
+        Список покупок всех пользователей, посчитанный по корзинам
+        """
+        return User.shopping_cart.through.objects.values(
+            'user_id',
+            ingredient_id=F('recipe__ingredients_amount__ingredient'),
+        ).annotate(
+            total=Sum('recipe__ingredients_amount__amount')
+        ).filter(ingredient_id__isnull=False).order_by()
+
+    def rebuild(self):
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(
+                (self.model(user_id=row['user_id'],
+                            ingredient_id=row['ingredient_id'],
+                            amount=row['total'])
+                 for row in self.live().iterator()),
+                batch_size=1000
+            )
+
+
+class ShoppingListItem(models.Model):
+    """
+    Список покупок пользователя: суммарное количество ингредиентов
+    рецептов из корзины, обновляется при изменении корзины
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField(verbose_name='Количество')
+
+    objects = ShoppingListManager()
+
+    class Meta:
+        verbose_name = 'Список покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            ),
+        ]
@@ -0,0 +1,311 @@
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import User
+from .jobs import enqueue_feed_backfill, enqueue_image_job
+from .models import (FeedItem, Ingredient, IngredientRecipe, Recipe,
+                     ShoppingListItem, StoredFile, Subscription, Tag)
+from .storage import image_storage
+
+# Поля автора в представлении рецепта
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+# Счётчики рецепта для связей пользователей с рецептами
+RECIPE_COUNTERS = {
+    User.favourites.through: 'favorites_count',
+    User.shopping_cart.through: 'in_carts_count',
+}
+
+
+def linked_ids(sender, instance, reverse, pk_set=None):
+    """
+    Id связанных с instance объектов, которые действительно
+    есть в промежуточной таблице (все, если pk_set не указан)
+    """
+    own, other = ('recipe_id', 'user_id') if reverse else (
+        'user_id', 'recipe_id')
+    links = sender.objects.filter(**{own: instance.pk})
+    if pk_set is not None:
+        links = links.filter(**{f'{other}__in': pk_set})
+    return set(links.values_list(other, flat=True))
+
+
+def update_recipe_counter(counter, instance, reverse, changed_ids, sign):
+    if reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+        step = sign * len(changed_ids)
+    else:
+        recipes = Recipe.objects.filter(pk__in=changed_ids)
+        step = sign
+    recipes.update(**{counter: F(counter) + step})
+
+
+def update_shopping_list(instance, reverse, changed_ids, sign):
+    """
+    Список покупок пересчитывается при добавлении и удалении
+    рецептов из корзины
+    """
+    if reverse:
+        ShoppingListItem.objects.apply(
+            changed_ids,
+            ShoppingListItem.objects.recipe_amounts([instance.pk]),
+            sign=sign)
+    else:
+        ShoppingListItem.objects.apply(
+            [instance.pk],
+            ShoppingListItem.objects.recipe_amounts(changed_ids),
+            sign=sign)
+
+
+@receiver(m2m_changed, sender=User.favourites.through)
+@receiver(m2m_changed, sender=User.shopping_cart.through)
+def user_recipes_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    # Удаляемые связи определяются до удаления: remove() передаёт
+    # в сигнал все указанные id, даже отсутствующие в таблице
+    if action == 'post_add':
+        changed_ids, sign = pk_set, 1
+    elif action == 'pre_remove':
+        changed_ids, sign = linked_ids(sender, instance, reverse, pk_set), -1
+    elif action == 'pre_clear':
+        changed_ids, sign = linked_ids(sender, instance, reverse), -1
+    else:
+        return
+    if not changed_ids:
+        return
+    update_recipe_counter(RECIPE_COUNTERS[sender], instance, reverse,
+                          changed_ids, sign)
+    if sender is User.shopping_cart.through:
+        update_shopping_list(instance, reverse, changed_ids, sign)
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def remember_previous_amount(sender, instance, **kwargs):
+    instance.previous_amount = None
+    if not instance._state.adding:
+        instance.previous_amount = IngredientRecipe.objects.filter(
+            pk=instance.pk).values_list(
+                'recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def update_shopping_lists_amount(sender, instance, **kwargs):
+    """
+    Ингредиент рецепта изменён через save() (например, в админке):
+    списки покупок с этим рецептом меняются на разницу количеств
+    """
+    previous = getattr(instance, 'previous_amount', None)
+    if previous is not None and previous[0] != instance.recipe_id:
+        ShoppingListItem.objects.update_recipe(
+            previous[0], {previous[1]: previous[2]}, {})
+        previous = None
+    ShoppingListItem.objects.update_recipe(
+        instance.recipe_id,
+        {previous[1]: previous[2]} if previous is not None else {},
+        {instance.ingredient_id: instance.amount}
+    )
+
+
+@receiver(pre_delete, sender=IngredientRecipe)
+def remove_shopping_lists_amount(sender, instance, **kwargs):
+    # Вызывается и при каскадном удалении рецепта или ингредиента:
+    # связи рецепта с корзинами удаляются после сигналов pre_delete
+    ShoppingListItem.objects.update_recipe(
+        instance.recipe_id, {instance.ingredient_id: instance.amount}, {})
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_links(sender, instance, **kwargs):
+    # Связи удаляемого пользователя удаляются каскадно, без m2m_changed
+    for through, counter in RECIPE_COUNTERS.items():
+        Recipe.objects.filter(
+            pk__in=linked_ids(through, instance, reverse=False)
+        ).update(**{counter: F(counter) - 1})
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_previous(sender, instance, **kwargs):
+    instance.previous_author_id = instance.previous_image = None
+    # Имя загруженного файла известно только после сохранения:
+    # в хранилище оно определяется содержимым
+    instance.image_uploaded = bool(
+        instance.image) and not instance.image._committed
+    if instance._state.adding:
+        return
+    previous = Recipe.objects.filter(pk=instance.pk).values_list(
+        'author_id', 'image').first()
+    if previous is not None:
+        instance.previous_author_id, instance.previous_image = previous
+
+
+@receiver(pre_save, sender=Recipe)
+def use_processed_image(sender, instance, **kwargs):
+    """
+    Фронтенд присылает исходное изображение при каждом изменении
+    рецепта. Если исходный файл уже заменён обработкой (поворот
+    по EXIF, уменьшение), рецепт получает обработанный файл
+    """
+    if not instance.image_uploaded:
+        return
+    name = image_storage.content_name(
+        instance.image.field.generate_filename(instance,
+                                               instance.image.name),
+        instance.image)
+    processed_name = StoredFile.objects.filter(name=name).exclude(
+        processed_name='').values_list('processed_name', flat=True).first()
+    if processed_name and image_storage.touch(processed_name):
+        instance.image = processed_name
+        instance.image_uploaded = False
+
+
+@receiver(post_save, sender=Recipe)
+def count_saved_recipe(sender, instance, **kwargs):
+    previous_author_id = getattr(instance, 'previous_author_id', None)
+    if previous_author_id == instance.author_id:
+        return
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=F('recipes_count') + 1)
+    if previous_author_id is not None:
+        User.objects.filter(pk=previous_author_id).update(
+            recipes_count=F('recipes_count') - 1)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    previous_author_id = getattr(instance, 'previous_author_id', None)
+    if not created and previous_author_id == instance.author_id:
+        return
+    if previous_author_id is not None:
+        FeedItem.objects.filter(recipe=instance).delete()
+    if FeedItem.objects.is_fanned_out(instance.author_id):
+        FeedItem.objects.fan_out(instance.author_id, [instance.id])
+
+
+@receiver(post_save, sender=Subscription)
+def subscribed(sender, instance, created, **kwargs):
+    if not created:
+        return
+    User.objects.filter(pk=instance.author_id).update(
+        followers_count=F('followers_count') + 1)
+    if FeedItem.objects.is_fanned_out(instance.author_id):
+        FeedItem.objects.backfill([instance.user_id], instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def unsubscribed(sender, instance, **kwargs):
+    # Строка автора блокируется до конца транзакции: одновременные
+    # отписки уменьшают счётчик по очереди, и переход через FANOUT_MAX
+    # видит ровно одна из них
+    followers_count = User.objects.select_for_update().filter(
+        pk=instance.author_id).values_list(
+            'followers_count', flat=True).first()
+    User.objects.filter(pk=instance.author_id).update(
+        followers_count=F('followers_count') - 1)
+    FeedItem.objects.filter(user_id=instance.user_id,
+                            author_id=instance.author_id).delete()
+    if followers_count is not None and (
+            followers_count - 1 <= FeedItem.objects.FANOUT_MAX
+            < followers_count):
+        # Рецепты автора больше не добавляются в ленты при чтении,
+        # ленты всех подписчиков заполняются в фоне
+        enqueue_feed_backfill(instance.author_id)
+
+
+@receiver(post_save, sender=Recipe)
+def count_image_references(sender, instance, **kwargs):
+    previous_image = getattr(instance, 'previous_image', None)
+    if instance.image.name == previous_image:
+        return
+    if instance.image:
+        StoredFile.objects.acquire(instance.image.name)
+    if previous_image:
+        StoredFile.objects.release(previous_image)
+
+
+@receiver(post_save, sender=Recipe)
+def enqueue_image_processing(sender, instance, **kwargs):
+    """
+    Проверка и уменьшение изображения выполняются в фоне,
+    см. команду process_image_jobs. Задача ставится для нового
+    изображения и для повторно загруженного после ошибки обработки;
+    то же изображение без ошибки обрабатывать заново не нужно
+    """
+    if not instance.image:
+        return
+    changed = instance.image.name != getattr(instance, 'previous_image',
+                                             None)
+    resent = getattr(instance, 'image_uploaded', False) and (
+        instance.image_status == Recipe.IMAGE_FAILED)
+    if not changed and not resent:
+        return
+    if instance.image_status != Recipe.IMAGE_PROCESSING:
+        instance.image_status = Recipe.IMAGE_PROCESSING
+        Recipe.objects.filter(pk=instance.pk).update(
+            image_status=Recipe.IMAGE_PROCESSING)
+    enqueue_image_job(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=F('recipes_count') - 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_image_reference(sender, instance, **kwargs):
+    if instance.image:
+        StoredFile.objects.release(instance.image.name)
+
+
+def touch_recipes(recipes):
+    """
+    Обновить время изменения рецептов, представление которых
+    зависит от изменившегося тега, ингредиента или автора
+    """
+    Recipe.objects.filter(pk__in=list(recipes.values_list(
+        'pk', flat=True))).update(modified=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(sender, instance, **kwargs):
+    touch_recipes(instance.recipes.all())
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, **kwargs):
+    touch_recipes(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def touch_ingredient_recipe(sender, instance, **kwargs):
+    # Ингредиент рецепта изменён напрямую (например, в админке);
+    # при переносе в другой рецепт меняются оба рецепта
+    previous = getattr(instance, 'previous_amount', None)
+    touch_recipes(Recipe.objects.filter(pk__in={
+        instance.recipe_id, previous[0] if previous else instance.recipe_id
+    }))
+
+
+@receiver(pre_save, sender=User)
+def remember_profile(sender, instance, update_fields=None, **kwargs):
+    instance.previous_profile = None
+    if instance._state.adding or (
+            update_fields is not None
+            and not set(update_fields) & set(AUTHOR_FIELDS)):
+        return
+    instance.previous_profile = User.objects.filter(
+        pk=instance.pk).values_list(*AUTHOR_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def profile_changed(sender, instance, **kwargs):
+    previous = getattr(instance, 'previous_profile', None)
+    if previous is not None and previous != tuple(
+            getattr(instance, field) for field in AUTHOR_FIELDS):
+        touch_recipes(instance.recipes.all())
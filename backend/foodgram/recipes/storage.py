@@ -0,0 +1,53 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, в котором имя файла - хэш его содержимого.
+    Одинаковые файлы хранятся в одном экземпляре: если файл уже есть,
+    он не записывается заново, а только обновляется время изменения,
+    чтобы сборщик мусора не удалил его до сохранения ссылки
+    (см. StoredFile и команду collect_orphaned_images).
+    """
+    @staticmethod
+    def content_name(name, content):
+        """
+        Имя, под которым content будет сохранён как name
+        """
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(os.path.dirname(name),
+                            content_digest(content) + extension)
+
+    def touch(self, name):
+        """
+        Обновить время изменения файла, если он есть
+        """
+        if not self.exists(name):
+            return False
+        os.utime(self.path(name))
+        return True
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.content_name(name, content)
+        if self.touch(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+image_storage = ContentAddressedStorage()
@@ -0,0 +1,212 @@
+import base64
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from users.models import User
+from .jobs import IMAGE_JOB_MAX_ATTEMPTS, run_feed_jobs, run_image_jobs
+from .models import (FeedBackfillJob, FeedItem, FeedManager, ImageJob,
+                     Ingredient, Recipe, StoredFile, Subscription, Tag)
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+def png_data(color=(255, 0, 0), size=(64, 64)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+class ImageJobsMixin:
+    """
+    Рецепты создаются через API, файлы сохраняются во временный каталог
+    """
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root,
+                                     CACHES=TEST_CACHES)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(
+            email='author@example.com',
+            username='author',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password-12345',
+        )
+        self.tag = Tag.objects.create(name='Завтрак', slug='breakfast',
+                                      color='#FF0000')
+        self.ingredient = Ingredient.objects.create(name='Яйца',
+                                                    measurement_unit='шт')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def recipe_data(self, image):
+        return {
+            'name': 'Омлет',
+            'text': 'Взбить яйца и пожарить',
+            'cooking_time': 10,
+            'image': image,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 3}],
+        }
+
+    def create_recipe(self, image):
+        response = self.client.post('/api/recipes/', self.recipe_data(image),
+                                    format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def get_recipe(self, recipe_id):
+        return self.client.get(f'/api/recipes/{recipe_id}/').data
+
+
+class ImageJobsTest(ImageJobsMixin, TestCase):
+    def test_image_processed(self):
+        recipe = self.get_recipe(self.create_recipe(png_data())['id'])
+        self.assertEqual(recipe['image_status'], Recipe.IMAGE_PROCESSING)
+        self.assertIsNone(recipe['images'])
+        self.assertEqual(run_image_jobs(), 1)
+        recipe = self.get_recipe(recipe['id'])
+        self.assertEqual(recipe['image_status'], Recipe.IMAGE_READY)
+        self.assertEqual(set(recipe['images']),
+                         {'thumbnail', 'card', 'full'})
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_image_failed(self):
+        recipe = self.create_recipe(png_data())
+        with mock.patch('recipes.jobs.process_image',
+                        side_effect=OSError('broken image')):
+            for _ in range(IMAGE_JOB_MAX_ATTEMPTS):
+                self.assertEqual(self.get_recipe(recipe['id'])[
+                    'image_status'], Recipe.IMAGE_PROCESSING)
+                self.assertEqual(run_image_jobs(), 1)
+        self.assertEqual(self.get_recipe(recipe['id'])['image_status'],
+                         Recipe.IMAGE_FAILED)
+        self.assertFalse(ImageJob.objects.exists())
+
+    def update_recipe(self, recipe_id, image):
+        response = self.client.put(f'/api/recipes/{recipe_id}/',
+                                   self.recipe_data(image), format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return self.get_recipe(recipe_id)
+
+    def test_same_image_not_processed_again(self):
+        image = png_data()
+        recipe = self.create_recipe(image)
+        run_image_jobs()
+        recipe = self.update_recipe(recipe['id'], image)
+        self.assertEqual(recipe['image_status'], Recipe.IMAGE_READY)
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_new_image_processed(self):
+        recipe = self.create_recipe(png_data())
+        run_image_jobs()
+        recipe = self.update_recipe(recipe['id'], png_data((0, 255, 0)))
+        self.assertEqual(recipe['image_status'], Recipe.IMAGE_PROCESSING)
+        self.assertEqual(run_image_jobs(), 1)
+        self.assertEqual(self.get_recipe(recipe['id'])['image_status'],
+                         Recipe.IMAGE_READY)
+
+    def test_resized_image_resent(self):
+        # Изображение больше IMAGE_MAX_SIZE обработка сохраняет новым
+        # файлом; повторно присланный исходный файл заменяется им
+        image = png_data(size=(3000, 200))
+        recipe = self.create_recipe(image)
+        run_image_jobs()
+        processed_name = Recipe.objects.get(pk=recipe['id']).image.name
+        recipe = self.update_recipe(recipe['id'], image)
+        self.assertEqual(recipe['image_status'], Recipe.IMAGE_READY)
+        self.assertFalse(ImageJob.objects.exists())
+        self.assertEqual(Recipe.objects.get(pk=recipe['id']).image.name,
+                         processed_name)
+        self.assertEqual(StoredFile.objects.get(
+            name=processed_name).references, 1)
+
+    def test_failed_image_resent(self):
+        image = png_data()
+        recipe = self.create_recipe(image)
+        Recipe.objects.filter(pk=recipe['id']).update(
+            image_status=Recipe.IMAGE_FAILED)
+        ImageJob.objects.all().delete()
+        recipe = self.update_recipe(recipe['id'], image)
+        self.assertEqual(recipe['image_status'], Recipe.IMAGE_PROCESSING)
+        self.assertEqual(run_image_jobs(), 1)
+        self.assertEqual(self.get_recipe(recipe['id'])['image_status'],
+                         Recipe.IMAGE_READY)
+
+
+@mock.patch.object(FeedManager, 'FANOUT_MAX', 1)
+class FeedBackfillTest(ImageJobsMixin, TestCase):
+    """
+    Когда подписчиков автора становится не больше FANOUT_MAX,
+    ленты подписчиков заполняются задачей из очереди
+    """
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(png_data())
+        self.followers = [
+            User.objects.create_user(
+                email=f'follower{number}@example.com',
+                username=f'follower{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='password-12345',
+            )
+            for number in range(3)
+        ]
+        for follower in self.followers:
+            Subscription.objects.create(user=follower, author=self.user)
+        # Рецепты автора с подписчиками больше FANOUT_MAX
+        # добавляются в ленты при чтении
+        FeedItem.objects.all().delete()
+
+    def unsubscribe(self, follower):
+        Subscription.objects.get(user=follower, author=self.user).delete()
+
+    def test_backfill_queued_once(self):
+        self.unsubscribe(self.followers[0])
+        self.assertFalse(FeedBackfillJob.objects.exists())
+        self.unsubscribe(self.followers[1])
+        self.assertEqual(FeedBackfillJob.objects.count(), 1)
+        follower = self.followers[2]
+        self.assertEqual(FeedItem.objects.recipe_ids(follower),
+                         [self.recipe['id']])
+        self.assertEqual(run_feed_jobs(), 1)
+        self.assertEqual(list(FeedItem.objects.values_list(
+            'user_id', 'recipe_id')), [(follower.id, self.recipe['id'])])
+        self.assertEqual(FeedItem.objects.recipe_ids(follower),
+                         [self.recipe['id']])
+
+    def test_backfill_skipped_for_large_author(self):
+        self.unsubscribe(self.followers[0])
+        self.unsubscribe(self.followers[1])
+        Subscription.objects.create(user=self.followers[0],
+                                    author=self.user)
+        self.assertEqual(run_feed_jobs(), 1)
+        self.assertFalse(FeedItem.objects.exists())
+
+
+@override_settings(IMAGE_JOBS_EAGER=True)
+class EagerImageJobsTest(ImageJobsMixin, TransactionTestCase):
+    """
+    С IMAGE_JOBS_EAGER изображение обрабатывается после фиксации
+    транзакции запроса
+    """
+    def test_image_processed(self):
+        recipe = self.create_recipe(png_data())
+        self.assertEqual(self.get_recipe(recipe['id'])['image_status'],
+                         Recipe.IMAGE_READY)
+        self.assertFalse(ImageJob.objects.exists())
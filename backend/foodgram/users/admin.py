@@ -5,6 +5,8 @@ from .models import User
 
 
 class UserAdmin(BaseUserAdmin):
+    list_display = BaseUserAdmin.list_display + (
+        'recipes_count', 'followers_count')
     list_filter = ('is_staff', 'is_superuser', 'is_active',
                    'groups', 'email', 'username')
 
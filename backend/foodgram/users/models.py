@@ -18,6 +18,16 @@ class User(AbstractUser):
         related_name='is_in_shopping_cart',
         verbose_name='Список покупок'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число подписчиков'
+    )
 
     class Meta:
         verbose_name = 'Пользователь'